@@ -13,7 +13,7 @@ setup(name        ='Nodesnap',
       author      ='Jimmy Thrasibule',
       package_dir = {'': 'src/lib'},
       packages    = ['app', 'fs', 'net', 'util'],
-      scripts     = ['src/scripts/nodesnap'],
+      scripts     = ['src/scripts/nodesnap', 'src/scripts/nodesnap-bench'],
       license     = 'GNU Affero General Public License version 3',
       keywords    = 'omniswitch cisco node network backup ssh telnet',
       classifiers = [
@@ -3,4 +3,4 @@
 # Package: app
 #
 
-__all__ = ['nodesnap']
\ No newline at end of file
+__all__ = ['daemon', 'nodesnap']
\ No newline at end of file
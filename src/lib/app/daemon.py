@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+#
+# Package: app.daemon
+#
+try:
+    import time
+    import heapq
+    import signal
+    import threading
+
+    import nodesnap
+
+    from net import reactor
+except ImportError, e:
+    raise ImportError(str(e) +
+"""
+    A critical module could not be imported.
+""")
+
+
+__all__ = ['SessionPool', 'Daemon']
+
+
+
+class SessionPool(object):
+    """
+    A bounded pool of logged-in nodes, one per node section.
+
+    A session is taken out of the pool while it is used, so two workers never
+    share it.
+    """
+
+    def __init__(self, size, idle):
+        """
+        SessionPool constructor.
+
+        :param size:
+            Maximum number of sessions kept open.
+
+        :param idle:
+            Number of seconds after which an unused session is closed.
+        """
+
+        self.size = size
+        self.idle = idle
+
+        # node section -> (host, last use)
+        self.__sessions = dict()
+        self.__lock = threading.Lock()
+
+
+
+    def get(self, node_section):
+        """
+        Takes the session of the given node section out of the pool. Returns
+        None if there is no usable session.
+
+        :param node_section:
+            Node's configuration section.
+        """
+
+        self.__lock.acquire()
+        try:
+            host, last_use = self.__sessions.pop(node_section, (None, None))
+        finally:
+            self.__lock.release()
+
+        if host is None:
+            return None
+
+        if time.time() - last_use > self.idle or not host.is_alive():
+            self.__quit(host)
+            return None
+
+        return host
+
+    def put(self, node_section, host):
+        """
+        Gives the session back to the pool. The least recently used session is
+        closed if the pool is full.
+
+        :param node_section:
+            Node's configuration section.
+
+        :param host:
+            Connected node.
+        """
+
+        evicted = list()
+
+        self.__lock.acquire()
+        try:
+            self.__sessions[node_section] = (host, time.time())
+
+            while len(self.__sessions) > self.size:
+                oldest = min(self.__sessions,
+                             key =lambda k: self.__sessions[k][1])
+                evicted.append(self.__sessions.pop(oldest)[0])
+        finally:
+            self.__lock.release()
+
+        # Sessions are closed outside of the lock.
+        for host in evicted:
+            self.__quit(host)
+
+    def evict_idle(self):
+        """
+        Closes the sessions unused for more than the idle time and returns
+        their number.
+        """
+
+        evicted = list()
+        limit = time.time() - self.idle
+
+        self.__lock.acquire()
+        try:
+            for node_section in self.__sessions.keys():
+                if self.__sessions[node_section][1] < limit:
+                    evicted.append(self.__sessions.pop(node_section)[0])
+        finally:
+            self.__lock.release()
+
+        for host in evicted:
+            self.__quit(host)
+
+        return len(evicted)
+
+    def close(self):
+        """
+        Closes every session.
+        """
+
+        self.__lock.acquire()
+        try:
+            sessions = self.__sessions.values()
+            self.__sessions = dict()
+        finally:
+            self.__lock.release()
+
+        for host, last_use in sessions:
+            self.__quit(host)
+
+    def __len__(self):
+        return len(self.__sessions)
+
+    def __quit(self, host):
+        """
+        Closes the given session, ignoring errors of dead sessions.
+        """
+
+        try:
+            host.quit()
+        except Exception:
+            pass
+
+
+
+
+class Daemon(nodesnap.Nodesnap):
+    """
+    Long-running nodesnap application.
+
+    The configuration is parsed once, logged-in sessions are kept in a pool
+    and each node is backed up at its own interval.
+
+    my_daemon = Daemon('/path/to/my/config_file')
+    my_daemon.run()
+    """
+
+    # Default values of the daemon options.
+    __default_sessions = 100
+    __default_idle     = 300
+    __default_interval = 86400
+
+    # Maximum time slept at once, so signals and idle sessions are handled
+    # quickly.
+    __tick = 1
+
+
+
+    def __init__(self, config_file):
+        """
+        Daemon constructor.
+
+        :param config_file:
+            Path to INI configuration file.
+        """
+
+        nodesnap.Nodesnap.__init__(self, config_file)
+
+        sessions = self.get_config_value('daemon', 'sessions')
+        if sessions is None:
+            sessions = self.__default_sessions
+
+        idle = self.get_config_value('daemon', 'idle')
+        if idle is None:
+            idle = self.__default_idle
+
+        self.pool = SessionPool(sessions, idle)
+        self.running = False
+
+
+
+    def get_interval(self, node_section):
+        """
+        Returns the number of seconds between two backups of the given node.
+
+        :param node_section:
+            Node's configuration section.
+        """
+
+        interval = self.get_config_value(node_section, 'interval')
+        if interval is None or interval < 1:
+            interval = self.__default_interval
+
+        return interval
+
+    def acquire_task(self, node_section):
+        """
+        Reactor task returning the pooled session of the given node, or a new
+        one if there is none. See Nodesnap.acquire_task().
+
+        :param node_section:
+            Node's configuration section.
+        """
+
+        host = self.pool.get(node_section)
+        if host is not None:
+            self.logger.debug('Reusing the session of ' + node_section)
+            yield reactor.Return((host, True))
+
+        host = yield self.connect_task(node_section)
+        yield reactor.Return((host, False))
+
+    def release(self, node_section, host, reusable =True):
+        """
+        Gives the session back to the pool, or closes it if it failed.
+
+        :param node_section:
+            Node's configuration section.
+
+        :param host:
+            Node object returned by acquire_task().
+
+        :param reusable:
+            False if the session failed and must not be used again.
+        """
+
+        if reusable:
+            self.pool.put(node_section, host)
+        else:
+            host.quit()
+
+    def stop(self, *args):
+        """
+        Ask the daemon to stop once the current pass is done. This method
+        can be used as a signal handler.
+        """
+
+        self.logger.info('Stopping.')
+        self.running = False
+
+    def run(self):
+        """
+        Main loop of the daemon: backup the nodes when they are due until
+        stop() is called.
+        """
+
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        self.clean_control_directory()
+
+        # Every node is due at start.
+        now = time.time()
+        schedule = [(now, node_section) \
+                    for node_section in self.get_node_sections()]
+        heapq.heapify(schedule)
+
+        self.logger.info('Daemon started with %(n)i nodes.' % \
+                         {'n': len(schedule)})
+
+        self.running = True
+        try:
+            while self.running and schedule:
+                now = time.time()
+
+                due = list()
+                while schedule and schedule[0][0] <= now:
+                    due.append(heapq.heappop(schedule))
+
+                if due:
+                    # A failing pass must not stop the daemon.
+                    try:
+                        self.run_sections([node_section \
+                                           for due_time, node_section in due])
+                    except Exception:
+                        self.logger.exception('Pass failed.')
+                    self.save_durations()
+                    self.log_summary(reset =True)
+
+                    # Nodes keep their pace unless the pass took longer
+                    # than their interval.
+                    now = time.time()
+                    for due_time, node_section in due:
+                        next_time = due_time + self.get_interval(node_section)
+                        heapq.heappush(schedule, (max(next_time, now),
+                                                  node_section))
+
+                evicted = self.pool.evict_idle()
+                if evicted:
+                    self.logger.debug('%(n)i idle sessions closed.' % \
+                                      {'n': evicted})
+
+                delay = schedule[0][0] - time.time()
+                if delay > 0:
+                    time.sleep(min(delay, self.__tick))
+        finally:
+            self.pool.close()
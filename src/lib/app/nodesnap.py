@@ -8,16 +8,102 @@ try:
 
     import re
     import os
-
-    from fs import backup
-    from net import mail, node
-    from util import config, date, text
+    import time
+    import json
+    import stat
+    import errno
+    import tempfile
+    import threading
+    import Queue
+
+    from fs import backup, objects, retention
+    from net import reactor
+    from util import config, date, lazy
 except ImportError, e:
     raise ImportError(str(e) +
 """
     A critical module could not be imported.
 """)
 
+# These modules are only imported when their feature is used: connecting to
+# nodes (pexpect), sending e-mails (smtplib and email), comparing
+# configurations, the 'sqlite' and 'git' backends and sharding.
+connect         = lazy.Module('net.connect')
+mail            = lazy.Module('net.mail')
+node            = lazy.Module('net.node')
+text            = lazy.Module('util.text')
+gitstore        = lazy.Module('fs.gitstore')
+sqlstore        = lazy.Module('fs.sqlstore')
+multiprocessing = lazy.Module('multiprocessing')
+
+
+
+class ShardLogHandler(logging.Handler):
+    """
+    Logging handler keeping the records of a shard's process, so they can be
+    sent back to the main process and merged in its log.
+    """
+
+    def __init__(self):
+        """
+        ShardLogHandler constructor.
+        """
+
+        logging.Handler.__init__(self)
+        self.records = list()
+
+
+
+    def emit(self, record):
+        """
+        Keep the given record as a dictionary.
+
+        Arguments and tracebacks may not be picklable, so the message is
+        formatted here.
+        """
+
+        item = dict(record.__dict__)
+        item['msg']  = record.getMessage()
+        item['args'] = None
+
+        if record.exc_info:
+            item['exc_text'] = logging.Formatter().formatException(record.exc_info)
+            item['exc_info'] = None
+
+        self.records.append(item)
+
+
+
+
+def run_shard(args):
+    """
+    Entry point of a shard's process. Backup the given node sections and
+    returns the run summary, the log records and the measured durations.
+
+    :param args:
+        A (configuration file, node sections) tuple.
+    """
+
+    config_file, node_sections = args
+
+    # The handlers inherited from the main process must not write in its log
+    # file.
+    logger = logging.getLogger('nodesnap')
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+
+    handler = ShardLogHandler()
+
+    shard = Nodesnap(config_file, handler)
+    try:
+        shard.run_sections(node_sections)
+    except Exception:
+        shard.logger.exception('Shard failed.')
+
+
+    return (shard.summary, handler.records, shard.durations)
+
+
 
 
 class Nodesnap(object):
@@ -31,29 +117,83 @@ class Nodesnap(object):
     __info_format  = '%(asctime)s: %(levelname)s: %(message)s'
     __debug_format = '%(asctime)s: %(levelname)s: %(module)s.%(funcName)s() at line %(lineno)d, %(message)s'
 
+    # Number of backups between two full copies in 'delta' storage.
+    __default_checkpoint = 10
 
 
-    def __init__(self, config_file):
+
+    def __init__(self, config_file, handler =None):
         """
         Nodesnap constructor.
 
         :param config_file:
             Path to INI configuration file.
+
+        :param handler:
+            Logging handler to use instead of the log file.
         """
 
         # Parse and load the configuration file.
+        self.config_file = config_file
         self.config = config.Config(config_file)
 
+        # Serializes the storage work done by the workers.
+        self.__storage_lock = threading.Lock()
+
+        # Run summary, updated by the workers.
+        self.summary = {'nodes': 0, 'new': 0, 'changed': 0, 'unchanged': 0,
+                        'failed': 0}
+        self.__summary_lock = threading.Lock()
+
+        # Duration of the last collection of each node, in seconds.
+        self.durations = dict()
+
+        # Files kept in each backup and diff directory.
+        self.retention = self.get_retention_policy()
+
+        # Files written for the last nodes, committed together.
+        self.batch = None
+        self.__batch_nodes = 0
+        commit_batch = self.get_config_value('general', 'commit_batch')
+        if commit_batch is not None and commit_batch > 1:
+            self.batch = backup.Batch()
+
+        # Control directory of the SSH masters, checked on first use.
+        self.__control_directory = None
+        self.__control_checked   = False
+
+        # SMTP connections shared by the e-mails of a run, opened by the
+        # first e-mail.
+        self.transport = None
+        self.__transport_lock = threading.Lock()
+
+        # Database or repository of the 'sqlite' and 'git' backends.
+        self.database   = None
+        self.repository = None
+
+        backend = self.get_config_value('general', 'backend')
+        if backend == 'sqlite':
+            # The files of a node are committed together by commit().
+            self.database = sqlstore.Database(self.get_database_file(),
+                                              False)
+        elif backend == 'git':
+            self.repository = gitstore.Repository(
+                                  self.get_config_value('general',
+                                                        'root_directory'))
+
         # Setup the logger.
         # TODO: put the logger in its own class and make it prettier.
         self.logger  = None
         self.handler = None
 
-        if self.get_config_value('logger', 'file_path'):
+        if handler is not None or self.get_config_value('logger', 'file_path'):
             self.__set_logger('nodesnap',
                               self.get_config_value('logger', 'file_path'),
                               self.get_config_value('logger', 'level'),
-                              self.get_config_value('logger', 'count'))
+                              self.get_config_value('logger', 'count'),
+                              handler)
+
+        self.durations = self.load_durations()
 
     def __del__(self):
         """
@@ -62,7 +202,7 @@ class Nodesnap(object):
 
         # We want one log file by run.
         # So we do a rollover on exit.
-        if self.handler:
+        if isinstance(self.handler, logging.handlers.RotatingFileHandler):
             self.handler.doRollover()
 
 
@@ -83,7 +223,7 @@ class Nodesnap(object):
         return None
 
     def __set_logger(self, name, filename,
-                     log_level =None, log_count =None):
+                     log_level =None, log_count =None, handler =None):
         """
         Configure the logger and returns it.
         
@@ -95,6 +235,9 @@ class Nodesnap(object):
             
         :param log_level:
             Logging level.
+
+        :param handler:
+            Logging handler to use instead of the log file.
         """
 
         level = logging.INFO
@@ -114,9 +257,11 @@ class Nodesnap(object):
 
         # Get the logger from the name.
         self.logger  = logging.getLogger(name)
-        self.handler = logging.handlers.RotatingFileHandler(filename,
-                                                            mode ='w',
-                                                            backupCount =log_count)
+        self.handler = handler
+        if self.handler is None:
+            self.handler = logging.handlers.RotatingFileHandler(filename,
+                                                                mode ='w',
+                                                                backupCount =log_count)
 
         # We use a different format for debugging purpose.
         if level == logging.INFO:
@@ -173,6 +318,209 @@ class Nodesnap(object):
         self.logger.debug('root_directory:' + root_directory)
         return root_directory
 
+    def get_database_file(self):
+        """
+        Returns the path of the database of the 'sqlite' backend.
+        """
+
+        database = self.get_config_value('general', 'database')
+        if database is None:
+            database = re.sub(os.sep + '$', '',
+                              self.get_config_value('general',
+                                                    'root_directory')) \
+                       + os.sep + 'nodesnap.db'
+
+        return database
+
+    def get_backup(self, item, node_section, pattern =None):
+        """
+        Returns the fs.storage.Storage object managing the given directory of
+        the given node, according to the 'backend', 'storage', 'compression'
+        and 'checkpoint' options.
+
+        :param item:
+            'backup' or 'diff', see get_root_directory().
+
+        :param node_section:
+            Node's configuration section.
+
+        :param pattern:
+            Date pattern of the file names, see format_filename(). Files
+            are dated by it whenever the catalog is rebuilt.
+        """
+
+        directory   = self.get_root_directory(item, node_section)
+        compression = self.get_config_value('general', 'compression')
+
+        # The directory is only a key in the database.
+        if self.database is not None:
+            root_directory = self.get_config_value('general',
+                                                   'root_directory')
+            return sqlstore.SQLiteBackup(self.database,
+                                         os.path.relpath(directory,
+                                                         root_directory),
+                                         compression)
+
+        storage = self.get_config_value('general', 'storage')
+
+        store = None
+        if storage == 'dedup':
+            root_directory = re.sub(os.sep + '$', '',
+                                    self.get_config_value('general',
+                                                          'root_directory'))
+            store = objects.ObjectStore(root_directory + os.sep + 'objects')
+
+        # Diffs don't follow each other, only backups are stored as deltas.
+        checkpoint = None
+        if storage == 'delta' and item == 'backup':
+            checkpoint = self.get_config_value('general', 'checkpoint')
+            if checkpoint is None or checkpoint < 1:
+                checkpoint = self.__default_checkpoint
+
+        if self.repository is not None:
+            return gitstore.GitBackup(self.repository, directory, store,
+                                      compression, checkpoint, self.batch,
+                                      pattern)
+
+        return backup.Backup(directory, store, compression, checkpoint,
+                             self.batch, pattern)
+
+    def commit(self, force =True):
+        """
+        Commit the files written for the last nodes if the batch is full,
+        along with the database or repository of the backend. The storage
+        lock must be held.
+
+        The database transaction is committed after every node whatever the
+        batch: its write lock would otherwise block the other processes while
+        the next nodes are fetched.
+
+        :param force:
+            Commit the files whatever the number of nodes.
+        """
+
+        if self.database is not None:
+            self.database.commit()
+
+        if self.batch is not None:
+            if not force:
+                self.__batch_nodes += 1
+                if self.__batch_nodes < self.get_config_value('general',
+                                                              'commit_batch'):
+                    return
+
+            self.__batch_nodes = 0
+            files = self.batch.commit()
+            if files:
+                self.logger.debug('%(n)i files committed.' % {'n': files})
+        elif not force:
+            # Without batch, files are committed once by run.
+            return
+
+        if self.repository is not None:
+            self.repository.commit('nodesnap: %(date)s' % \
+                                   {'date': time.strftime('%Y-%m-%d %H:%M:%S')})
+
+    def get_retention_policy(self):
+        """
+        Returns the retention policy applied to the backup and diff
+        directories, built from the 'rotation', 'keep_*' and 'max_age'
+        options.
+        """
+
+        return retention.Policy(
+                   last    =self.get_config_value('general', 'rotation'),
+                   daily   =self.get_config_value('general', 'keep_daily'),
+                   weekly  =self.get_config_value('general', 'keep_weekly'),
+                   monthly =self.get_config_value('general', 'keep_monthly'),
+                   max_age =self.get_config_value('general', 'max_age'))
+
+    def rebuild_catalogs(self):
+        """
+        Rebuild the catalog of every backup and diff directory of the
+        configured nodes, for instance after files have been added or removed
+        by hand.
+        """
+
+        files = 0
+        for node_section in self.get_node_sections():
+            # Without a connection, the node's hostname is unknown.
+            pattern = self.format_filename(node_section, None, False)
+
+            for item in ('backup', 'diff'):
+                directory = self.get_root_directory(item, node_section)
+                if self.database is not None or os.path.isdir(directory):
+                    files += self.get_backup(item, node_section,
+                                             pattern).rebuild_catalog()
+
+        self.logger.info('Catalogs rebuilt, %(n)i files.' % {'n': files})
+
+
+    def get_control_directory(self):
+        """
+        Returns the directory holding the OpenSSH control sockets used by
+        multiplexed SSH connections.
+        """
+
+        directory = self.get_config_value('general', 'control_directory')
+        if directory is None:
+            directory = os.path.join(tempfile.gettempdir(),
+                                     'nodesnap-%(uid)i' % {'uid': os.getuid()})
+
+        return directory
+
+    def check_control_directory(self):
+        """
+        Returns the control directory, created if it doesn't exist, or None
+        if it can't be trusted: it must be a real directory owned by the
+        current user, with no permission for the group and the others.
+        Otherwise another user could plant sockets in it.
+
+        The directory is checked once, multiplexing is disabled if it fails.
+        """
+
+        if self.__control_checked:
+            return self.__control_directory
+
+        directory = self.get_control_directory()
+        try:
+            try:
+                os.makedirs(directory, 0700)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+            info = os.lstat(directory)
+            if not stat.S_ISDIR(info.st_mode) \
+               or info.st_uid != os.getuid() \
+               or info.st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+                self.logger.warning('%(d)s is not a private directory of the current user, SSH multiplexing is disabled.' % \
+                                    {'d': directory})
+                directory = None
+        except OSError, e:
+            self.logger.warning('%(d)s: %(e)s, SSH multiplexing is disabled.' % \
+                                {'d': directory, 'e': e.strerror})
+            directory = None
+
+        self.__control_directory = directory
+        self.__control_checked = True
+
+        return directory
+
+    def clean_control_directory(self):
+        """
+        Remove the control sockets left behind by masters which died.
+        """
+
+        directory = self.check_control_directory()
+        if directory is None:
+            return
+
+        removed = connect.clean_control_directory(directory)
+        if removed:
+            self.logger.info('%(n)i stale SSH control sockets removed.' % \
+                             {'n': removed})
+
 
     def connect(self, node_section):
         """
@@ -187,6 +535,16 @@ class Nodesnap(object):
             Node's configuration section.
         """
 
+        return reactor.call(self.connect_task(node_section))
+
+    def connect_task(self, node_section):
+        """
+        Reactor task trying to connect to the given node. See connect().
+
+        :param node_section:
+            Node's configuration section.
+        """
+
         hostname   = self.get_config_value(node_section, 'hostname')
         connection = self.get_config_value(node_section, 'connection')
         failover   = self.get_config_value(node_section, 'failover')
@@ -229,7 +587,7 @@ class Nodesnap(object):
                 # We don't have fail over solution so we quit.
                 self.logger.info('Connection to %(h)s failed.' % \
                                  {'h': hostname})
-                return None
+                yield reactor.Return(None)
 
             if node_type == 'Cisco':
                 host = node.Cisco(mode, hostname, username, password, prompt,
@@ -244,19 +602,33 @@ class Nodesnap(object):
                 host = node.SR77xx(mode, hostname, username, password, prompt,
                                    timeout)
 
+            if host and mode == 'ssh' \
+               and self.get_config_value(node_section, 'multiplex'):
+                # Later connections to this node will reuse the
+                # authenticated channel of a persistent master.
+                control_directory = self.check_control_directory()
+
+                control_persist = self.get_config_value(node_section,
+                                                        'control_persist')
+                if control_persist is None:
+                    control_persist = 600
+
+                if control_directory is not None:
+                    host.set_control(control_directory, control_persist)
+
             if host:
                 # We have an host so we try to connect to it.
-                if host.connect():
+                if (yield host.connect_task()):
                     # Connection succeed.
                     self.logger.info('Connection to %(h)s succeed.' % \
                                      {'h': hostname})
-                    return host
+                    yield reactor.Return(host)
             if fail:
                 # If we are here, this mean that we are trying the fail over
                 # solution and it failed too. So we quit.
                 self.logger.info('Connection to %(h)s failed.' % \
                                  {'h': hostname})
-                return None
+                yield reactor.Return(None)
 
             # If we reach here, the first try failed.
             self.logger.info('Connection %(m)s failed.' % {'m': mode})
@@ -278,7 +650,8 @@ class Nodesnap(object):
         
         :param host:
             Node object. This object can be used in order to get some
-            information from the host.
+            information from the host. If it is None and the pattern needs
+            the node's hostname, None is returned.
         
         :param apply_date:
             Should we applying the date on the pattern?
@@ -288,6 +661,8 @@ class Nodesnap(object):
         self.logger.debug('Input pattern: ' + pattern)
 
         if re.match('%0', pattern):
+            if host is None:
+                return None
             pattern = re.sub('%0',
                              host.get_hostname(),
                              pattern)
@@ -301,102 +676,632 @@ class Nodesnap(object):
             return date.today_to_str(pattern)
         return pattern
 
+    def get_durations_file(self):
+        """
+        Returns the path of the file holding the duration of the last
+        collection of each node.
+        """
+
+        durations_file = self.get_config_value('general', 'durations_file')
+        if durations_file is None:
+            durations_file = re.sub(os.sep + '$', '',
+                                    self.get_config_value('general',
+                                                          'root_directory')) \
+                             + os.sep + '.durations'
+
+        return durations_file
+
+    def load_durations(self):
+        """
+        Returns the durations measured during the previous runs.
+        """
+
+        durations_file = self.get_durations_file()
+        if not os.path.exists(durations_file):
+            return dict()
+
+        try:
+            f = open(durations_file, 'r')
+            try:
+                return dict(json.load(f))
+            finally:
+                f.close()
+        except (IOError, ValueError, TypeError), e:
+            self.logger.warning('Could not read %(f)s: %(e)s.' % \
+                                {'f': durations_file,
+                                 'e': e})
+            return dict()
+
+    def save_durations(self):
+        """
+        Writes the measured durations for the next runs.
+        """
+
+        durations_file = self.get_durations_file()
+
+        directory = os.path.dirname(durations_file)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # Nodes removed from the configuration are forgotten.
+        node_sections = set(self.get_node_sections())
+        durations = dict([(k, v) for k, v in self.durations.items() \
+                          if k in node_sections])
+
+        # The file is replaced at once, so a crash never leaves it truncated.
+        fd, path = tempfile.mkstemp(prefix ='.durations.',
+                                    suffix ='.tmp',
+                                    dir =directory or os.curdir)
+        try:
+            f = os.fdopen(fd, 'w')
+            try:
+                json.dump(durations, f)
+            finally:
+                f.close()
+            os.rename(path, durations_file)
+        except Exception:
+            os.unlink(path)
+            raise
+
+    def get_default_duration(self):
+        """
+        Returns the duration given to the nodes never collected: as long as
+        the longest one, or 1 second if no duration is known yet, so they
+        still weigh on the shards' loads.
+        """
+
+        if self.durations:
+            return max(max(self.durations.values()), 1)
+
+        return 1
+
+    def sort_sections(self, node_sections):
+        """
+        Returns the given node sections ordered by 'priority', highest first,
+        then by the duration of their last collection, longest first.
+
+        Starting the longest collections first keeps the workers busy until
+        the end and shortens the run. Nodes never collected are considered as
+        long as the longest one.
+
+        :param node_sections:
+            List of node sections.
+        """
+
+        default = self.get_default_duration()
+
+        def key(node_section):
+            priority = self.get_config_value(node_section, 'priority') or 0
+            return (-priority, -self.durations.get(node_section, default))
+
+        return sorted(node_sections, key =key)
+
+    def get_node_sections(self):
+        """
+        Returns the flat list of node sections to process.
+        """
+
+        # Nodes of the inventory file are read as they come, only their
+        # section names are kept.
+        return list(self.config.iter_nodes_section())
+
+    def count(self, key):
+        """
+        Increment the given counter of the run summary.
+
+        :param key:
+            Counter's name: 'nodes', 'new', 'changed', 'unchanged' or
+            'failed'.
+        """
+
+        self.__summary_lock.acquire()
+        try:
+            self.summary[key] += 1
+        finally:
+            self.__summary_lock.release()
+
     def run(self):
         """
         Main method for the nodesnap application. This method is the only one
         you may need to call and it will do the rest.
         """
 
-        # Get all node sections from the configuration.
-        sections = self.config.get_nodes_section()
-
-        # Loop for each node's type
-        for key in sections.keys():
-            self.logger.debug('Loop for ' + key)
-
-            # Loop for each node of this type.
-            for node_section in sections.get(key):
-                self.logger.debug('Section ' + node_section)
-
-                # We first try to connect the node.
-                host = self.connect(node_section)
-                if not host:
-                    # If we can't connect, we pass.
-                    continue
-
-                # Set up the backup's root directory and filename.
-                config_directory = self.get_root_directory('backup',
-                                                           node_section)
-                filename = self.format_filename(node_section, host)
-
-                # We get the running configuration without any comments.
-                running_config = host.get_config(True, True)
-
-                # Print the running configuration contents for debugging.
-                self.logger.debug('**** Running config ***')
-                for line in running_config:
-                    self.logger.debug(line)
-
-                # We create a new Backup object to store the running
-                # configuration.
-                config_bak = backup.Backup(config_directory)
-
-                # The pattern will help use to find the most recent file.
-                # TODO: add an option to specify if we want to use it or not.
-                pattern = self.format_filename(node_section, host, False)
-                last_bak = config_bak.get_most_recent_file_content(pattern)
-
-                if not last_bak:
-                    # There is no file.
-                    # So, we can write our backup without any other test.
-                    config_bak.write(filename, running_config)
-
-                    # Lets send the running configuration.
-                    self.send('backup', node_section, running_config)
-                else:
-                    # We found an older backup file.
-
-                    # Lets print its content for debugging.
-                    self.logger.debug('**** Last config ***')
-                    for line in last_bak:
-                        self.logger.debug(line)
-
-                    # Once again we use the pattern to get the most recent
-                    # backup's filename.
-                    last_filename = config_bak.get_most_recent_filename(pattern)
-
-                    # Then we compare both old backup and currently running
-                    # configuration.
-                    delta = text.compare(last_bak, running_config)
-                    if delta:
-                        # We found some differences so we can write the backup
-                        # file and send it.
-                        config_bak.write(filename, running_config)
-                        self.send('backup', node_section, running_config)
-
-                        if self.get_config_value('general', 'write_diff'):
-                            # If the user wants to store the diff we create a
-                            #new backup object for this one.
-                            delta_directory = self.get_root_directory('diff',
-                                                                      node_section)
-                            delta_bak = backup.Backup(delta_directory)
-
-                            # We add the filenames in top of diff file.
-                            delta.insert(0, '%(old)s -> %(new)s\n\n' % \
-                                            {'old': last_filename,
-                                             'new': filename})
-
-                            delta_bak.write(filename, delta)
-                            self.send('diff', node_section, delta)
-
-                            # Apply file rotation on the diff directory.
-                            delta_bak.rotate(self.get_config_value('general',
-                                                                   'rotation'))
-
-                # Apply file rotation on the backup directory.
-                config_bak.rotate(self.get_config_value('general', 'rotation'))
-
-                host.quit()
+        node_sections = self.get_node_sections()
+
+        self.clean_control_directory()
+
+        processes = self.get_config_value('general', 'processes')
+        if processes is not None and processes > 1 and len(node_sections) > 1:
+            self.__run_shards(node_sections, processes)
+        else:
+            self.run_sections(node_sections)
+
+        self.save_durations()
+        self.log_summary()
+
+    def log_summary(self, reset =False):
+        """
+        Write the run summary in the log.
+
+        :param reset:
+            Set all the counters back to zero once written.
+        """
+
+        self.__summary_lock.acquire()
+        try:
+            self.logger.info('Summary: %(nodes)i nodes, %(new)i new, %(changed)i changed, %(unchanged)i unchanged, %(failed)i failed.' % \
+                             self.summary)
+
+            if reset:
+                for key in self.summary:
+                    self.summary[key] = 0
+        finally:
+            self.__summary_lock.release()
+
+    def run_sections(self, node_sections):
+        """
+        Backup the given node sections in the current process.
+
+        :param node_sections:
+            List of node sections to process.
+        """
+
+        node_sections = self.sort_sections(node_sections)
+
+        workers = self.get_config_value('general', 'workers')
+        if workers is None or workers < 1:
+            workers = 1
+
+        try:
+            if self.get_config_value('general', 'engine') == 'reactor':
+                self.__run_reactor(node_sections, workers)
+            elif workers < 2 or len(node_sections) < 2:
+                # Loop for each node.
+                for node_section in node_sections:
+                    self.process(node_section)
+            else:
+                self.__run_pool(node_sections, workers)
+        finally:
+            # The last batch of files is committed.
+            self.__storage_lock.acquire()
+            try:
+                self.commit()
+            finally:
+                self.__storage_lock.release()
+
+            self.close_transport()
+
+    def __run_shards(self, node_sections, processes):
+        """
+        Split the node sections in shards and process each of them in its
+        own process, so the text processing uses every core.
+
+        The log records and summaries of the shards are merged back in the
+        main process.
+
+        :param node_sections:
+            List of node sections to process.
+
+        :param processes:
+            Number of processes.
+        """
+
+        # Longest nodes first, each one goes to the least loaded shard.
+        shards = [list() for i in range(min(processes, len(node_sections)))]
+        loads  = [0] * len(shards)
+
+        default = self.get_default_duration()
+
+        # On equal loads, the shard with the fewest nodes is chosen.
+        for node_section in self.sort_sections(node_sections):
+            i = min(range(len(shards)),
+                    key =lambda i: (loads[i], len(shards[i])))
+            shards[i].append(node_section)
+            loads[i] += self.durations.get(node_section, default)
+
+        shards = [shard for shard in shards if shard]
+
+        self.logger.info('Processing %(n)i nodes in %(p)i processes.' % \
+                         {'n': len(node_sections),
+                          'p': len(shards)})
+
+        pool = multiprocessing.Pool(len(shards))
+        try:
+            results = pool.map(run_shard,
+                               [(self.config_file, shard) for shard in shards])
+        finally:
+            pool.close()
+            pool.join()
+
+        records = list()
+        for summary, shard_records, durations in results:
+            for key in summary:
+                self.summary[key] += summary[key]
+            records.extend(shard_records)
+            self.durations.update(durations)
+
+        # Records are written in the order they were emitted.
+        records.sort(key =lambda record: record['created'])
+        for record in records:
+            self.logger.handle(logging.makeLogRecord(record))
+
+    def __run_pool(self, node_sections, workers):
+        """
+        Process the given node sections with a pool of worker threads.
+
+        :param node_sections:
+            List of node sections to process.
+
+        :param workers:
+            Maximum number of nodes processed at the same time.
+        """
+
+        queue = Queue.Queue()
+        for node_section in node_sections:
+            queue.put(node_section)
+
+        self.logger.info('Processing %(n)i nodes with %(w)i workers.' % \
+                         {'n': len(node_sections),
+                          'w': min(workers, len(node_sections))})
+
+        threads = list()
+        for i in range(min(workers, len(node_sections))):
+            thread = threading.Thread(target =self.__worker,
+                                      args =(queue,),
+                                      name ='worker-%i' % i)
+            thread.setDaemon(True)
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join()
+
+    def __run_reactor(self, node_sections, sessions):
+        """
+        Process the given node sections in a single thread: every session is
+        driven by a reactor task and waits for its data in the same poll()
+        call.
+
+        :param node_sections:
+            List of node sections to process.
+
+        :param sessions:
+            Maximum number of sessions opened at the same time.
+        """
+
+        loop = reactor.Reactor()
+
+        pending = list(node_sections)
+        pending.reverse()
+
+        self.logger.info('Processing %(n)i nodes with %(s)i sessions.' % \
+                         {'n': len(node_sections),
+                          's': min(sessions, len(node_sections))})
+
+        def start_next(task =None):
+            # A failing node must not stop the others.
+            if task is not None and task.error is not None:
+                self.count('failed')
+                self.logger.error('Section %(s)s failed.' % \
+                                  {'s': task.node_section},
+                                  exc_info =task.error)
+
+            if pending:
+                node_section = pending.pop()
+                task = loop.add(self.process_task(node_section), start_next)
+                task.node_section = node_section
+
+        for i in range(min(sessions, len(pending))):
+            start_next()
+
+        loop.run()
+
+    def __worker(self, queue):
+        """
+        Worker thread's loop: process node sections until the queue is empty.
+
+        :param queue:
+            Queue holding the node sections to process.
+        """
+
+        while True:
+            try:
+                node_section = queue.get_nowait()
+            except Queue.Empty:
+                return
+
+            # A failing node must not stop the worker, the other nodes still
+            # have to be processed.
+            try:
+                self.process(node_section)
+            except Exception:
+                self.count('failed')
+                self.logger.exception('Section %(s)s failed.' % \
+                                      {'s': node_section})
+
+    def process(self, node_section):
+        """
+        Backup the given node.
+
+        Connecting and fetching the configuration may be done by many workers
+        at the same time. Comparing, writing and rotating files are serialized
+        so nodes sharing a group directory can finish together safely.
+
+        :param node_section:
+            Node's configuration section.
+        """
+
+        reactor.call(self.process_task(node_section))
+
+    def process_task(self, node_section):
+        """
+        Reactor task backing up the given node. See process().
+
+        :param node_section:
+            Node's configuration section.
+        """
+
+        self.logger.debug('Section ' + node_section)
+        self.count('nodes')
+
+        start = time.time()
+
+        # We first try to connect the node.
+        host, reused = yield self.acquire_task(node_section)
+
+        while True:
+            if not host:
+                # If we can't connect, we pass.
+                self.count('failed')
+                self.durations[node_section] = time.time() - start
+                yield reactor.Return(None)
+
+            reusable = False
+            try:
+                try:
+                    running_config, filename, pattern = \
+                        yield self.fetch_task(node_section, host)
+                    reusable = True
+                finally:
+                    self.release(node_section, host, reusable)
+                    self.durations[node_section] = time.time() - start
+            except Exception:
+                if not reused:
+                    raise
+
+                # The node may have closed a session reused from a previous
+                # run, it is retried once with a new login.
+                self.logger.info('Reused session of %(s)s failed, connecting again.' % \
+                                 {'s': node_section})
+                reused = False
+                host = yield self.connect_task(node_section)
+                continue
+
+            break
+
+        # Print the running configuration contents for debugging.
+        self.logger.debug('**** Running config ***')
+        for line in running_config:
+            self.logger.debug(line)
+
+        self.__storage_lock.acquire()
+        try:
+            messages = self.store(node_section, filename, pattern,
+                                  running_config)
+            self.commit(False)
+        finally:
+            self.__storage_lock.release()
+
+        # Mails don't touch the storage, they are sent outside of the lock.
+        for item, msg in messages:
+            self.send(item, node_section, msg)
+
+    def fetch_task(self, node_section, host):
+        """
+        Reactor task fetching the running configuration of the given node.
+        Returns a (running configuration, filename, pattern) tuple.
+
+        :param node_section:
+            Node's configuration section.
+
+        :param host:
+            Connected node.
+        """
+
+        # We get the running configuration without any comments.
+        running_config = yield host.get_config_task(True, True)
+
+        # The hostname is fetched once, the filenames are then built
+        # without any other exchange with the node.
+        yield host.get_hostname_task()
+
+        # Set up the backup's filename.
+        filename = self.format_filename(node_section, host)
+
+        # The pattern will help use to find the most recent file.
+        # TODO: add an option to specify if we want to use it or not.
+        pattern = self.format_filename(node_section, host, False)
+
+        yield reactor.Return((running_config, filename, pattern))
+
+    def acquire_task(self, node_section):
+        """
+        Reactor task returning a (node, reused) tuple: a connected node for
+        the given section, or None if the connection failed, and whether its
+        session was opened by a previous run.
+
+        :param node_section:
+            Node's configuration section.
+        """
+
+        host = yield self.connect_task(node_section)
+        yield reactor.Return((host, False))
+
+    def release(self, node_section, host, reusable =True):
+        """
+        Called once the node's configuration has been fetched.
+
+        :param node_section:
+            Node's configuration section.
+
+        :param host:
+            Node object returned by acquire_task().
+
+        :param reusable:
+            False if the session failed and must not be used again.
+        """
+
+        host.quit()
+
+    def store(self, node_section, filename, pattern, running_config):
+        """
+        Compare the running configuration with the last backup, write the
+        backup and diff files if needed and apply the retention policy.
+
+        Returns the list of (item, message) tuples to send to contacts.
+
+        :param node_section:
+            Node's configuration section.
+
+        :param filename:
+            Backup's filename.
+
+        :param pattern:
+            Filename pattern used to find the most recent backup.
+
+        :param running_config:
+            Node's running configuration.
+        """
+
+        messages = list()
+
+        # Trailing blanks are not kept, as they are lost when a backup is
+        # read back.
+        running_config = backup.normalize(running_config)
+        running_digest = backup.digest(running_config)
+
+        # We create a new Backup object to store the running
+        # configuration.
+        config_bak = self.get_backup('backup', node_section, pattern)
+
+        # Most nodes didn't change: if the digest of the last backup is
+        # known, there is no need to read and compare it.
+        last_digest, last_filename = config_bak.get_last_digest(pattern)
+        if last_digest == running_digest:
+            self.count('unchanged')
+            config_bak.apply_retention(self.retention)
+
+            return messages
+
+        # The digest is unknown, for instance for an old backup: the last
+        # backup is hashed while it is read, without building its content.
+        if last_digest is None:
+            last_filename = config_bak.get_most_recent_filename(pattern)
+            if last_filename is not None and \
+               backup.digest(config_bak.iter_most_recent_file_content(
+                                 pattern)) == running_digest:
+                config_bak.set_last_digest(os.path.basename(last_filename),
+                                           running_digest)
+                self.count('unchanged')
+                config_bak.apply_retention(self.retention)
+
+                return messages
+
+        last_bak = config_bak.get_most_recent_file_content(pattern)
+
+        if not last_bak:
+            # There is no file.
+            # So, we can write our backup without any other test.
+            config_bak.write(filename, running_config)
+
+            # Lets send the running configuration.
+            messages.append(('backup', running_config))
+            self.count('new')
+        else:
+            # We found an older backup file.
+
+            # Lets print its content for debugging.
+            self.logger.debug('**** Last config ***')
+            for line in last_bak:
+                self.logger.debug(line)
+
+            # Once again we use the pattern to get the most recent
+            # backup's filename.
+            last_filename = config_bak.get_most_recent_filename(pattern)
+
+            # Then we compare both old backup and currently running
+            # configuration.
+            delta = text.compare(last_bak, running_config,
+                                 self.get_config_value('general',
+                                                       'diff_hints'))
+            if delta:
+                # We found some differences so we can write the backup
+                # file and send it.
+                config_bak.write(filename, running_config)
+                messages.append(('backup', running_config))
+                self.count('changed')
+
+                if self.get_config_value('general', 'write_diff'):
+                    # If the user wants to store the diff we create a
+                    #new backup object for this one.
+                    delta_bak = self.get_backup('diff', node_section,
+                                                pattern)
+
+                    # We add the filenames in top of diff file.
+                    delta.insert(0, '%(old)s -> %(new)s\n\n' % \
+                                    {'old': last_filename,
+                                     'new': filename})
+
+                    delta_bak.write(filename, delta)
+                    messages.append(('diff', delta))
+
+                    # Apply the retention policy on the diff directory.
+                    delta_bak.apply_retention(self.retention)
+            else:
+                # The digest was unknown, we record it for the next run.
+                config_bak.set_last_digest(os.path.basename(last_filename),
+                                           running_digest)
+                self.count('unchanged')
+
+        # Apply the retention policy on the backup directory.
+        config_bak.apply_retention(self.retention)
+
+        return messages
+
+    def get_transport(self):
+        """
+        Returns the net.mail.Transport object of the run, created on first
+        use.
+        """
+
+        self.__transport_lock.acquire()
+        try:
+            if self.transport is None:
+                max_messages = self.get_config_value('contact',
+                                                     'mail_messages')
+                if max_messages is None or max_messages < 1:
+                    max_messages = 100
+
+                self.transport = mail.Transport(max_messages)
+
+            return self.transport
+        finally:
+            self.__transport_lock.release()
+
+    def close_transport(self):
+        """
+        Closes the SMTP connections opened during the run.
+        """
+
+        self.__transport_lock.acquire()
+        try:
+            transport = self.transport
+            self.transport = None
+        finally:
+            self.__transport_lock.release()
+
+        if transport is not None:
+            transport.close()
 
     def send(self, item, node_section, msg):
         """
@@ -412,9 +1317,7 @@ class Nodesnap(object):
             Message to send.
         """
 
-        sections = self.config.get_subsections('contact')
-
-        for contact in sections.get('contact'):
+        for contact in self.config.get_subsection_list('contact'):
             sender = self.get_config_value(contact, 'sender')
             mail_server = self.get_config_value(contact, 'mail_server')
             to = self.get_config_value(contact, 'e-mail')
@@ -439,4 +1342,4 @@ class Nodesnap(object):
             if mail_server:
                 email.set_server(mail_server)
 
-            email.send()
+            email.send(self.get_transport())
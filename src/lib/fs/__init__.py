@@ -3,4 +3,5 @@
 # Package: fs
 #
 
-__all__ = ['backup']
\ No newline at end of file
+__all__ = ['backup', 'catalog', 'delta', 'gitstore', 'objects', 'retention',
+           'sqlstore', 'storage']
\ No newline at end of file
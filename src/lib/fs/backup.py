@@ -5,53 +5,421 @@
 try:
     import re
     import os
+    import sys
+    import bz2
+    import gzip
+    import mmap
+    import time
+    import zlib
+    import errno
+    import hashlib
     import logging
+    import tempfile
+    import threading
     import util.date
+    import util.lazy
+
+    import catalog
+    import storage
 except ImportError, e:
     raise ImportError(str(e) +
 """
     A critical module could not be imported.
 """)
 
+# Deltas are only used with checkpoints.
+delta = util.lazy.Module('fs.delta')
+
+
+__all__ = ['Backup', 'Batch', 'normalize', 'digest', 'open_file',
+           'iter_lines', 'strip_suffix']
+
+
+
+# Characters removed at the end of each line.
+_blanks = '\b \t\n\r\f\v'
+
+# Compression formats: name -> (file suffix, compressor factory).
+# The gzip format is produced by zlib with a window size of 16 + 15.
+_compressions = {'gzip': ('.gz', lambda: zlib.compressobj(6, zlib.DEFLATED,
+                                                          31)),
+                 'bz2':  ('.bz2', bz2.BZ2Compressor)}
+
+# Temporary files are created private, the written files get the usual mode.
+_umask = os.umask(0)
+os.umask(_umask)
+_file_mode = 0666 & ~_umask
 
-__all__ = ['Backup']
+# Temporary files older than this, in seconds, were left by a crash.
+_stale_age = 86400
 
 
 
-class Backup(object):
+def normalize(content):
     """
-    This class manages backup files.
+    Returns the given lines without their trailing blanks, as they are read
+    back from a backup file.
+
+    :param content:
+        Any iterable of lines.
+    """
+
+    return [line.rstrip(_blanks) for line in content]
+
+def digest(content):
     """
+    Returns the SHA-256 hexadecimal digest of the normalized content.
+
+    :param content:
+        Any iterable of lines.
+    """
+
+    h = hashlib.sha256()
+    separator = ''
+    for line in content:
+        h.update(separator + line.rstrip(_blanks))
+        separator = '\n'
+
+    return h.hexdigest()
+
+def open_file(path):
+    """
+    Opens a backup file for reading. Compressed files are decompressed as
+    they are read, according to their suffix.
+
+    :param path:
+        Path of the file.
+    """
+
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.bz2'):
+        return bz2.BZ2File(path, 'r')
+
+    return open(path, 'r')
+
+def iter_lines(path):
+    """
+    Returns an iterator on the lines of a backup file, without their trailing
+    blanks.
+
+    Plain files are memory-mapped and each line is only copied when it is
+    reached, so a large file is read without building its whole content.
+    Compressed files are decompressed as they are read.
+
+    :param path:
+        Path of the file.
+
+    :raise IOError:
+        If the file cannot be opened.
+    """
+
+    f = open_file(path)
+    if strip_suffix(path) != path:
+        return _iter_file(f)
 
-    def __init__(self, root_directory):
+    try:
+        # An empty file cannot be mapped.
+        if os.fstat(f.fileno()).st_size == 0:
+            return iter(())
+
+        data = mmap.mmap(f.fileno(), 0, access =mmap.ACCESS_READ)
+    finally:
+        # The mapping doesn't need the file to stay open.
+        f.close()
+
+    return _iter_mapped(data)
+
+def _iter_file(f):
+    """
+    Yields the lines of an open file without their trailing blanks, then
+    closes it.
+    """
+
+    try:
+        for line in f:
+            yield line.rstrip(_blanks)
+    finally:
+        f.close()
+
+def _iter_mapped(data):
+    """
+    Yields the lines of a memory-mapped file without their trailing blanks,
+    then closes the mapping. Lines are split as when the file is read.
+    """
+
+    try:
+        size = len(data)
+        start = 0
+        while start < size:
+            end = data.find('\n', start)
+            if end < 0:
+                end = size
+            yield data[start:end].rstrip(_blanks)
+            start = end + 1
+    finally:
+        data.close()
+
+def strip_suffix(filename):
+    """
+    Returns the file name without its compression suffix.
+    """
+
+    for suffix, factory in _compressions.itervalues():
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)]
+
+    return filename
+
+
+
+
+def sync_directory(directory):
+    """
+    Makes sure that the entries of the given directory are written on the
+    disk.
+    """
+
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+
+
+class Batch(object):
+    """
+    This class groups the writes of several Backup objects.
+
+    Written files stay in hidden temporary files until commit() is called.
+    They are then synced on the disk, moved to their final name and each
+    directory is synced once, whatever the number of files it received.
+    After a crash, the files of the last batch are missing but no file is
+    truncated.
+    """
+
+    def __init__(self):
+        """
+        Batch constructor.
+        """
+
+        # (temporary path, callback, directories) tuples.
+        self.__files = list()
+        # Functions called once the files are committed.
+        self.__actions = list()
+        self.__lock = threading.Lock()
+
+
+
+    def add(self, path, callback, directories):
+        """
+        Adds a written temporary file to the batch.
+
+        :param path:
+            Path of the temporary file.
+        :param callback:
+            Function called once the file is synced, which moves it to its
+            final place.
+        :param directories:
+            Directories to sync after the callback.
+        """
+
+        self.__lock.acquire()
+        try:
+            self.__files.append((path, callback, directories))
+        finally:
+            self.__lock.release()
+
+    def defer(self, action):
+        """
+        Calls the given function once the files are committed.
+        """
+
+        self.__lock.acquire()
+        try:
+            self.__actions.append(action)
+        finally:
+            self.__lock.release()
+
+    def commit(self):
+        """
+        Syncs the temporary files, moves them to their final place, syncs
+        their directories and returns the number of committed files.
+        """
+
+        self.__lock.acquire()
+        try:
+            files = self.__files
+            actions = self.__actions
+            self.__files = list()
+            self.__actions = list()
+        finally:
+            self.__lock.release()
+
+        # A failing file doesn't stop the others: its temporary file is
+        # removed and the first error is raised once everything is done.
+        error = None
+        synced = list()
+        for path, callback, file_directories in files:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except Exception:
+                error = error or sys.exc_info()
+                self.__discard(path)
+                continue
+
+            synced.append((path, callback, file_directories))
+
+        directories = set()
+        for path, callback, file_directories in synced:
+            try:
+                callback()
+            except Exception:
+                error = error or sys.exc_info()
+                self.__discard(path)
+                continue
+
+            directories.update(file_directories)
+
+        for directory in directories:
+            sync_directory(directory)
+
+        for action in actions:
+            try:
+                action()
+            except Exception:
+                error = error or sys.exc_info()
+
+        if error is not None:
+            raise error[0], error[1], error[2]
+
+        return len(files)
+
+    def __discard(self, path):
+        """
+        Removes the temporary file of a file which could not be committed.
+        """
+
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    def __len__(self):
+        return len(self.__files)
+
+
+
+
+class Backup(storage.Storage):
+    """
+    This class manages backup files in a directory.
+
+    With an object store, identical contents are stored once (see
+    fs.objects). Files may be compressed, they are then read back as a
+    stream. Plain and compressed files can be mixed in a directory.
+
+    Files are written in a temporary file first, then renamed, so a file is
+    never seen half written. With a batch (see Batch), files are only synced
+    and renamed when the batch is committed.
+
+    With checkpoints, only the most recent file is kept in full. Older files
+    are replaced by reverse deltas ('.rdelta' files, see fs.delta) applying
+    to the next file, and a full copy is kept every 'checkpoint' files to
+    bound the cost of rebuilding an old file.
+
+    The files of the directory are indexed in a catalog (see fs.catalog), with
+    the digest of their content, so the most recent file and an unchanged
+    content are found without listing the directory or reading the file
+    back.
+    """
+
+    # Suffix of the reverse delta files.
+    __delta_suffix = '.rdelta'
+
+
+
+    def __init__(self, root_directory, objects =None, compression =None,
+                 checkpoint =None, batch =None, pattern =None):
         """
         Backup constructor.
+
+        :param root_directory:
+            Backup directory.
+        :param objects:
+            fs.objects.ObjectStore object. If given, files are stored once
+            in it and the directory only holds links to them.
+        :param compression:
+            Compression of the written files, 'gzip' or 'bz2'. Files are
+            written as plain text if it is None.
+        :param checkpoint:
+            Number of files between two full copies. Older files are kept as
+            reverse deltas if it is given.
+        :param batch:
+            Batch object committing the written files. Files are committed
+            at once if it is None. Deltas read back the previous files, so
+            the batch is not used with checkpoints.
+        :param pattern:
+            Date pattern of the file names, used to date the files whenever
+            the catalog is rebuilt (see rebuild_catalog()).
         """
 
+        if compression is not None and compression not in _compressions:
+            raise ValueError("Unknown compression '%(c)s'." % \
+                             {'c': compression})
+        if objects is not None and checkpoint is not None:
+            raise ValueError('Deltas cannot be stored in an object store.')
+
         self.__root_directory = re.sub(os.sep + '$', '', root_directory)
         self.logger = logging.getLogger('nodesnap')
 
+        self.objects = objects
+        self.compression = compression
+        self.pattern = pattern
+        self.checkpoint = checkpoint
 
+        self.batch = None
+        if checkpoint is None:
+            self.batch = batch
 
-    def __get_files_timestamp(self):
-        """
-        Returns a dictionary containing all backup files timestamp using
-        operating system capabilities.
-        """
+        self.catalog = catalog.Catalog(self.__root_directory)
 
-        return dict([(self.__root_directory + os.sep + f, \
-                      os.stat(self.__root_directory + os.sep + f).st_ctime) \
-                     for f in self.get_filenames_list()])
+        # Whether the stale temporary files have been removed.
+        self.__swept = False
 
-    def __get_files_timestamp_by_pattern(self, pattern):
+
+
+    def __get_catalog(self, pattern =None):
         """
-        Returns a dictionary containing all backup files timestamp using
-        dates in files name.
+        Returns the catalog of the directory, rebuilding it if it is missing
+        or if its most recent file has been removed.
+
+        :param pattern:
+            Date pattern of the file names, the one given to the constructor
+            by default.
         """
 
-        return dict([(self.__root_directory + os.sep +f, \
-                      util.date.str_to_date(f, pattern)) \
-                      for f in self.get_filenames_list()])
+        if pattern is None:
+            pattern = self.pattern
+
+        if not self.catalog.exists():
+            if self.get_filenames_list():
+                self.rebuild_catalog(pattern)
+        else:
+            latest = self.catalog.latest()
+            if latest is not None and \
+               not os.path.exists(self.__root_directory + os.sep + latest):
+                self.logger.warning('%(path)s catalog is out of date.' % \
+                                    {'path': self.__root_directory})
+                self.rebuild_catalog(pattern)
+
+        return self.catalog
 
 
     def get_filenames_list(self):
@@ -70,77 +438,541 @@ class Backup(object):
     def get_most_recent_filename(self, pattern =None):
         """
         Returns most recent backup file's name.
-        """
 
-        files_timestamp = dict()
-
-        if pattern is not None:
-            files_timestamp = self.__get_files_timestamp_by_pattern(pattern)
-        else:
-            files_timestamp = self.__get_files_timestamp()
+        :param pattern:
+            Date pattern of the file names, only used if the catalog has to be
+            rebuilt.
+        """
 
-        if not files_timestamp:
+        latest = self.__get_catalog(pattern).latest()
+        if latest is None:
             return None
 
-        return max(files_timestamp, key=lambda k: files_timestamp.get(k))
+        return self.__root_directory + os.sep + latest
 
     def get_most_recent_file_content(self, pattern =None):
         """
         Returns most recent backup file's content.
         """
 
-        last_file = self.get_most_recent_filename(pattern =pattern)
-        if last_file is None:
+        latest = self.__get_catalog(pattern).latest()
+        if latest is None:
             return list()
 
-        f = open(last_file, 'r')
-        content = list([(re.sub('[\b\s\n\r]*$', '', line)) \
-                         for line in f.readlines()])
-        f.close()
+        return self.read(latest)
+
+    def iter_most_recent_file_content(self, pattern =None):
+        """
+        Returns an iterator on the most recent backup file's content. The file
+        is read as the iterator goes, see iter_lines().
+        """
 
+        latest = self.__get_catalog(pattern).latest()
+        if latest is None:
+            return iter(())
+
+        if self.__is_delta(latest):
+            return iter(self.read(latest))
+
+        return iter_lines(self.__root_directory + os.sep + latest)
+
+    def read(self, filename):
+        """
+        Returns the content of a file of the directory, rebuilding it from
+        the following files if it is stored as a reverse delta.
+
+        :param filename:
+            File name, as returned by write().
+
+        :raise IOError:
+            If a file needed to rebuild the content is missing.
+        """
+
+        # We follow the deltas up to a full file...
+        deltas = list()
+        names = None
+        while self.__is_delta(filename):
+            lines = self.__read_lines(filename)
+            deltas.append(lines[1:])
+
+            if names is None:
+                names = dict([(self.__get_name(f[0]), f[0]) \
+                              for f in self.__get_catalog().files()])
+
+            base = lines[0][len('base '):]
+            if base not in names:
+                raise IOError("%(path)s: base file '%(base)s' is missing." % \
+                              {'path': self.__root_directory + os.sep \
+                                       + filename,
+                               'base': base})
+            filename = names[base]
+
+        # ... then we apply them from the most recent one.
+        content = self.__read_lines(filename)
+        for lines in reversed(deltas):
+            content = delta.apply(content, lines)
 
         return content
 
+    def __read_lines(self, filename):
+        """
+        Returns the lines of a file of the directory, as stored.
+        """
 
+        return list(iter_lines(self.__root_directory + os.sep + filename))
 
-    def rotate(self, n):
+    def __is_delta(self, filename):
         """
-        Remove oldest files in the backup directory.
-        
-        :param n:
-            Number of files to keep.
+        Returns True if the file is stored as a reverse delta.
+        """
+
+        return strip_suffix(filename).endswith(self.__delta_suffix)
+
+    def __get_name(self, filename):
+        """
+        Returns the file name given to write(), without the compression and
+        delta suffixes.
+        """
+
+        filename = strip_suffix(filename)
+        if filename.endswith(self.__delta_suffix):
+            filename = filename[:-len(self.__delta_suffix)]
+
+        return filename
+
+    def __get_base(self, filename):
+        """
+        Returns the name of the file a reverse delta applies to.
+        """
+
+        f = open_file(self.__root_directory + os.sep + filename)
+        try:
+            return f.readline().rstrip(_blanks)[len('base '):]
+        finally:
+            f.close()
+
+    def get_last_digest(self, pattern =None):
+        """
+        Returns a (digest, path) tuple for the most recent file, or
+        (None, None) if its digest is unknown.
+        """
+
+        latest = self.__get_catalog(pattern).latest()
+        if latest is None:
+            return (None, None)
+
+        value = self.catalog.get(latest)[2]
+        if value is None:
+            return (None, None)
+
+        return (value, self.__root_directory + os.sep + latest)
+
+    def set_last_digest(self, filename, value):
+        """
+        Records the digest of a file of the directory.
+
+        :param filename:
+            File name.
+        :param value:
+            Digest of the file content, see digest().
+        """
+
+        self.catalog.set_digest(filename, value)
+
+    def rebuild_catalog(self, pattern =None):
+        """
+        Rebuilds the catalog from the files of the directory and returns
+        the number of indexed files.
+
+        :param pattern:
+            Date pattern of the file names, the one given to the constructor
+            by default. Files are dated by their modification time if there
+            is none or if it doesn't match.
+        """
+
+        if pattern is None:
+            pattern = self.pattern
+
+        self.__remove_stale_files()
+
+        entries = list()
+        for f in self.get_filenames_list():
+            path = self.__root_directory + os.sep + f
+            st = os.stat(path)
+
+            timestamp = st.st_mtime
+            if pattern is not None:
+                try:
+                    timestamp = time.mktime(
+                        util.date.str_to_date(self.__get_name(f),
+                                              pattern).timetuple())
+                except ValueError:
+                    pass
+
+            # The digest of a delta is only known once it is rebuilt.
+            value = None
+            if not self.__is_delta(f):
+                value = digest(iter_lines(path))
+
+            entries.append((f, timestamp, st.st_size, value))
+
+        self.catalog.rebuild(entries)
+
+        self.logger.info('%(path)s catalog rebuilt, %(n)i files.' % \
+                         {'path': self.__root_directory, 'n': len(entries)})
+
+        return len(entries)
+
+
+
+    def __remove_stale_files(self):
+        """
+        Removes the temporary files left in the directory by a crash between
+        the write and the rename of a file.
+
+        Files of a running batch are recent: only the files whose status
+        didn't change for a day are removed. Their modification time may be
+        set in the past, their change time is used.
+        """
+
+        self.__swept = True
+
+        if not os.path.exists(self.__root_directory):
+            return
+
+        limit = time.time() - _stale_age
+        for f in os.listdir(self.__root_directory):
+            if not (f.startswith('.') and f.endswith('.tmp')):
+                continue
+
+            path = self.__root_directory + os.sep + f
+            try:
+                if os.stat(path).st_ctime < limit:
+                    os.unlink(path)
+                    self.logger.info('%(path)s: stale temporary file removed.' % \
+                                     {'path': path})
+            except OSError:
+                # Removed by another process.
+                pass
+
+
+
+    def apply_retention(self, policy):
+        """
+        Remove the files selected by the given retention policy and returns
+        their number. The catalog is updated with a single write.
+
+        :param policy:
+            fs.retention.Policy object.
+        """
+
+        if policy.is_empty():
+            return 0
+
+        # The written files are not in the catalog yet.
+        if self.batch is not None:
+            self.batch.defer(lambda: self.__apply_retention(policy))
+            return 0
+
+        return self.__apply_retention(policy)
+
+    def __apply_retention(self, policy):
+        """
+        See apply_retention().
         """
 
-        files_timestamp = self.__get_files_timestamp()
-        if files_timestamp and (len(files_timestamp) > n):
-            # We remove oldest files.
-            for f in sorted(files_timestamp, key=lambda k: files_timestamp.get(k))[:n]:
-                os.unlink(f)
+        files = self.__get_catalog()
+        entries = files.files()
+        obsolete = policy.select(entries)
+        if not obsolete:
+            return 0
+
+        # A delta applying to a removed file is rebuilt first, then kept in
+        # full. Deltas apply to the next file.
+        rebuilt = list()
+        removed = set(obsolete)
+        for n in xrange(len(entries) - 1):
+            f = entries[n][0]
+            if f not in removed and self.__is_delta(f) and \
+               entries[n + 1][0] in removed:
+                rebuilt.append((entries[n], self.read(f)))
+
+        for f in obsolete:
+            self.__unlink(f)
+        files.remove(obsolete)
+
+        for entry, content in rebuilt:
+            self.__unlink(entry[0])
+            files.remove([entry[0]])
+            self.__write_file(self.__get_name(entry[0]), content, entry[1],
+                              entry[3])
+
+        self.logger.info('%(path)s: %(n)i old files removed.' % \
+                         {'path': self.__root_directory, 'n': len(obsolete)})
+
+        return len(obsolete)
 
     def write(self, filename, content):
         """
-        This method writes the given content in the backup directory.
+        This method writes the given content in the backup directory and
+        returns the name of the written file, with its compression suffix.
         
         :param filename:
             File name.
         :param content:
-            File content.
+            File content, any iterable of lines.
         """
 
         # We create the directory if it doesn't exists.
+        # Another process may create it at the same time.
         if not os.path.exists(self.__root_directory):
-            os.makedirs(self.__root_directory)
+            try:
+                os.makedirs(self.__root_directory)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        # Files written before the catalog existed are indexed first.
+        self.__get_catalog()
+
+        # The temporary files left by a crash are removed on the first
+        # write.
+        if not self.__swept:
+            self.__remove_stale_files()
+
+        if self.checkpoint is None:
+            return self.__write_file(filename, content)
+
+        content = normalize(content)
+        latest = self.catalog.latest()
+
+        # A file with the same name may be the base of the previous delta,
+        # which is rebuilt before the file is replaced.
+        dependents = list()
+        if latest is not None and self.__get_name(latest) == filename:
+            entries = self.catalog.files()
+            if len(entries) > 1 and self.__is_delta(entries[-2][0]) and \
+               self.__get_base(entries[-2][0]) == filename:
+                dependents.append((entries[-2][0],
+                                   self.read(entries[-2][0])))
+
+        written = self.__write_file(filename, content)
+
+        for f, lines in dependents:
+            self.__write_delta(f, filename, content, lines)
+
+        # The previous file is replaced by a reverse delta, unless it is a
+        # checkpoint.
+        if latest is not None and self.__get_name(latest) != filename and \
+           not self.__is_delta(latest) and \
+           self.__count_deltas(latest) + 1 < self.checkpoint:
+            self.__write_delta(latest, filename, content, self.read(latest))
+
+        return written
+
+    def __count_deltas(self, filename):
+        """
+        Returns the number of reverse deltas right before the given file.
+        """
+
+        names = [entry[0] for entry in self.catalog.files()]
+
+        n = 0
+        for f in reversed(names[:names.index(filename)]):
+            if not self.__is_delta(f):
+                break
+            n += 1
+
+        return n
+
+    def __write_delta(self, filename, base_name, base, content):
+        """
+        Replaces a file of the directory by a reverse delta.
+
+        :param filename:
+            Replaced file.
+        :param base_name:
+            Name of the file the delta applies to.
+        :param base:
+            Content of this file.
+        :param content:
+            Content of the replaced file.
+        """
+
+        entry = self.catalog.get(filename)
+
+        lines = ['base ' + base_name] + delta.make(base, content)
+        name = self.__get_name(filename) + self.__delta_suffix
+
+        written = self.__write_file(name, lines, entry[0], entry[2])
+        if written != filename:
+            self.__unlink(filename)
+            self.catalog.remove([filename])
+
+    def __write_file(self, filename, content, timestamp =None, value =None):
+        """
+        Writes a file of the directory, adds it to the catalog and returns its
+        name with its compression suffix.
+
+        :param timestamp:
+            Date of the file, now if it is not given.
+        :param value:
+            Digest recorded in the catalog, the digest of the content if it is
+            not given.
+        """
+
+        compressor = None
+        if self.compression is not None:
+            suffix, factory = _compressions[self.compression]
+            filename += suffix
+            compressor = factory()
 
         # We open the file and write its content.
-        f = open(self.__root_directory + os.sep + filename, 'w')
-        f.writelines('\n'.join(content))
+        # Lines are written as they come, so the content can be streamed.
+        # The digest is computed on the way.
+        # The content is written in a temporary file first, which is
+        # renamed or, with an object store, only kept if it is not already
+        # stored. Its name is unique, it is removed if the write fails.
+        final_path = self.__root_directory + os.sep + filename
+        fd, path = tempfile.mkstemp(prefix ='.' + filename + '.',
+                                    suffix ='.tmp',
+                                    dir =self.__root_directory)
+
+        f = os.fdopen(fd, 'w')
+        try:
+            os.fchmod(fd, _file_mode)
+
+            h = hashlib.sha256()
+            separator = ''
+            for line in content:
+                data = separator + line
+                if compressor is not None:
+                    f.write(compressor.compress(data))
+                else:
+                    f.write(data)
+                h.update(separator + line.rstrip(_blanks))
+                separator = '\n'
+
+            if compressor is not None:
+                f.write(compressor.flush())
+
+            f.flush()
+            # We make sure that the file is really written on the disk,
+            # unless it is done with the whole batch.
+            if self.batch is None:
+                os.fsync(f.fileno())
+
+            size = f.tell()
+
+            # Closing the file.
+            f.close()
+        except Exception:
+            f.close()
+            os.unlink(path)
+            raise
+
+        if value is None:
+            value = h.hexdigest()
+
+        # The file keeps its date if it is given, so the catalog can be
+        # rebuilt.
+        if timestamp is None:
+            timestamp = time.time()
+        else:
+            os.utime(path, (timestamp, timestamp))
 
-        # We make sure that the file is really written on the disk.
-        f.flush()
-        os.fsync(f.fileno())
+        def commit():
+            if self.objects is not None:
+                self.__store(filename, path, value)
+            else:
+                os.rename(path, final_path)
 
-        self.logger.info('%(path)s written.' % \
-                         {'path': self.__root_directory + os.sep + filename})
+            self.logger.info('%(path)s written.' % {'path': final_path})
 
-        # Closing the file.
-        f.close()
+            self.catalog.add(filename, timestamp, size, value)
+            self._changed(filename)
+
+        directories = [self.__root_directory]
+        if self.objects is not None:
+            directories.append(os.path.dirname(
+                self.objects.get_path(self.__get_object_key(filename,
+                                                            value))))
+
+        if self.batch is not None:
+            self.batch.add(path, commit, directories)
+        else:
+            commit()
+            for directory in directories:
+                sync_directory(directory)
+
+        return filename
+
+    def __store(self, filename, path, value):
+        """
+        Links the file to the stored object with the given digest, storing
+        the temporary file as this object if there is none.
+        """
+
+        key = self.__get_object_key(filename, value)
+        final_path = self.__root_directory + os.sep + filename
+
+        # The object is linked under a temporary name, which then replaces a
+        # file with the same name at once: the file listed in the catalog is
+        # never missing.
+        link_path = path[:-len('.tmp')] + '.link.tmp'
+        try:
+            if self.objects.link(key, link_path):
+                os.unlink(path)
+            else:
+                self.objects.add(key, path)
+                self.objects.link(key, link_path)
+
+            os.rename(link_path, final_path)
+
+            # rename() does nothing if both are links to the same object.
+            if os.path.exists(link_path):
+                os.unlink(link_path)
+        except Exception:
+            if os.path.exists(link_path):
+                os.unlink(link_path)
+            raise
+
+        # The object of the replaced file is released.
+        entry = self.catalog.get(filename)
+        if entry is not None and entry[2] is not None:
+            self.objects.release(self.__get_object_key(filename, entry[2]))
+
+    def __get_object_key(self, filename, value):
+        """
+        Returns the key of the stored object of a file. Objects with the
+        same content but another compression are different objects.
+        """
+
+        return value + filename[len(strip_suffix(filename)):]
+
+    def __unlink(self, filename):
+        """
+        Removes a file of the directory and releases its stored object.
+        """
+
+        try:
+            os.unlink(self.__root_directory + os.sep + filename)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+
+        self._changed(filename)
+
+        if self.objects is not None:
+            entry = self.catalog.get(filename)
+            if entry is not None and entry[2] is not None:
+                self.objects.release(self.__get_object_key(filename,
+                                                           entry[2]))
+
+    def _changed(self, filename):
+        """
+        Called when a file of the directory is written or removed. Backends
+        built on this class can override it.
+        """
+
+        pass
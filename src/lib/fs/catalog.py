@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+#
+# Package: fs.catalog
+#
+try:
+    import os
+    import bisect
+except ImportError, e:
+    raise ImportError(str(e) +
+"""
+    A critical module could not be imported.
+""")
+
+
+__all__ = ['Catalog']
+
+
+
+class Catalog(object):
+    """
+    This class indexes the files of a backup directory.
+
+    The catalog is an append-only journal kept in a hidden file of the
+    directory. Each record adds a file, with its timestamp, size and digest,
+    or removes one. The journal is read once and the files are then looked
+    up in memory, without listing or stating the directory.
+    """
+
+    # Name of the journal file.
+    filename = '.catalog'
+
+    # The journal is compacted when it holds more than this number of
+    # records and twice as many records as files.
+    __compact_threshold = 64
+
+
+
+    def __init__(self, directory):
+        """
+        Catalog constructor.
+
+        :param directory:
+            Indexed directory.
+        """
+
+        self.__directory = directory
+        self.__path = directory + os.sep + self.filename
+
+        # filename -> (timestamp, size, digest)
+        self.__entries = None
+        # Sorted list of (timestamp, filename).
+        self.__index = None
+        # Number of records in the journal.
+        self.__records = 0
+
+
+
+    def exists(self):
+        """
+        Returns True if the journal file exists.
+        """
+
+        return os.path.exists(self.__path)
+
+    def __load(self):
+        """
+        Reads the journal if it is not already done.
+        """
+
+        if self.__entries is not None:
+            return
+
+        self.__entries = dict()
+        self.__records = 0
+
+        if not os.path.exists(self.__path):
+            return
+
+        f = open(self.__path, 'r')
+        try:
+            for line in f:
+                fields = line.rstrip('\n').split('\t')
+                # A truncated record, the process was killed while writing.
+                if fields[0] == '+' and len(fields) == 5:
+                    digest = fields[4]
+                    if digest == '-':
+                        digest = None
+                    self.__entries[fields[1]] = (float(fields[2]),
+                                                 int(fields[3]), digest)
+                elif fields[0] == '-' and len(fields) == 2:
+                    self.__entries.pop(fields[1], None)
+                else:
+                    continue
+                self.__records += 1
+        finally:
+            f.close()
+
+    def __get_index(self):
+        """
+        Returns the (timestamp, filename) list sorted by timestamp.
+        """
+
+        self.__load()
+        if self.__index is None:
+            self.__index = sorted([(entry[0], filename) \
+                                   for filename, entry \
+                                   in self.__entries.iteritems()])
+
+        return self.__index
+
+    def __format(self, filename):
+        """
+        Returns the journal record adding the given file.
+        """
+
+        timestamp, size, digest = self.__entries[filename]
+        if digest is None:
+            digest = '-'
+
+        return '+\t%(filename)s\t%(timestamp)r\t%(size)i\t%(digest)s\n' % \
+               {'filename': filename, 'timestamp': timestamp, 'size': size,
+                'digest': digest}
+
+    def __append(self, records):
+        """
+        Appends the given records to the journal, compacting it if needed.
+        """
+
+        self.__records += len(records)
+
+        if self.__records > self.__compact_threshold and \
+           self.__records > 2 * len(self.__entries):
+            self.compact()
+            return
+
+        f = open(self.__path, 'a')
+        try:
+            f.write(''.join(records))
+        finally:
+            f.close()
+
+
+
+    def add(self, filename, timestamp, size, digest =None):
+        """
+        Adds or replaces a file in the catalog.
+
+        :param filename:
+            File name, relative to the directory.
+        :param timestamp:
+            File's date, in seconds since the epoch.
+        :param size:
+            File's size in bytes.
+        :param digest:
+            Digest of the file content, if known.
+        """
+
+        self.__load()
+        self.__entries[filename] = (timestamp, size, digest)
+        self.__index = None
+
+        self.__append([self.__format(filename)])
+
+    def remove(self, filenames):
+        """
+        Removes the given files from the catalog, with a single write.
+
+        :param filenames:
+            List of file names.
+        """
+
+        self.__load()
+
+        records = list()
+        for filename in filenames:
+            if self.__entries.pop(filename, None) is not None:
+                records.append('-\t%(filename)s\n' % {'filename': filename})
+
+        if records:
+            self.__index = None
+            self.__append(records)
+
+    def set_digest(self, filename, digest):
+        """
+        Records the digest of a file already in the catalog.
+        """
+
+        self.__load()
+
+        entry = self.__entries.get(filename)
+        if entry is None or entry[2] == digest:
+            return
+
+        self.__entries[filename] = (entry[0], entry[1], digest)
+        self.__append([self.__format(filename)])
+
+    def get(self, filename):
+        """
+        Returns the (timestamp, size, digest) tuple of the given file, or None
+        if it is not in the catalog.
+        """
+
+        self.__load()
+
+        return self.__entries.get(filename)
+
+    def latest(self):
+        """
+        Returns the name of the most recent file, or None if the catalog is
+        empty.
+        """
+
+        index = self.__get_index()
+        if not index:
+            return None
+
+        return index[-1][1]
+
+    def oldest(self, n):
+        """
+        Returns the names of the n oldest files, oldest first.
+        """
+
+        return [filename for timestamp, filename in self.__get_index()[:n]]
+
+    def between(self, start, end):
+        """
+        Returns the names of the files whose timestamp is in [start, end),
+        oldest first.
+
+        :param start:
+            Lower bound, in seconds since the epoch.
+        :param end:
+            Upper bound, in seconds since the epoch.
+        """
+
+        index = self.__get_index()
+        lo = bisect.bisect_left(index, (start, ''))
+        hi = bisect.bisect_left(index, (end, ''))
+
+        return [filename for timestamp, filename in index[lo:hi]]
+
+    def files(self):
+        """
+        Returns the (filename, timestamp, size, digest) list of the catalog,
+        oldest first.
+        """
+
+        self.__load()
+
+        return [(filename, ) + self.__entries[filename] \
+                for timestamp, filename in self.__get_index()]
+
+    def compact(self):
+        """
+        Rewrites the journal with a single record by file.
+        """
+
+        self.__load()
+
+        # The journal is replaced at once, so it is never read half written.
+        f = open(self.__path + '.tmp', 'w')
+        try:
+            f.write(''.join([self.__format(filename) \
+                             for timestamp, filename \
+                             in self.__get_index()]))
+        finally:
+            f.close()
+        os.rename(self.__path + '.tmp', self.__path)
+
+        self.__records = len(self.__entries)
+
+    def rebuild(self, entries):
+        """
+        Replaces the catalog content with the given entries.
+
+        :param entries:
+            List of (filename, timestamp, size, digest) tuples.
+        """
+
+        self.__entries = dict([(entry[0], tuple(entry[1:])) \
+                               for entry in entries])
+        self.__index = None
+
+        self.compact()
+
+    def __len__(self):
+        self.__load()
+
+        return len(self.__entries)
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#
+# Package: fs.delta
+#
+try:
+    from util import text
+except ImportError, e:
+    raise ImportError(str(e) +
+"""
+    A critical module could not be imported.
+""")
+
+
+__all__ = ['make', 'apply']
+
+
+
+def make(base, target):
+    """
+    Returns the delta rebuilding target from base, as a list of lines.
+
+    A delta is a list of operations:
+     - '= start count', copy count lines of base from start (0-based);
+     - '+ count', followed by the count lines to insert.
+
+    :param base:
+        List of lines the delta applies to.
+    :param target:
+        List of lines rebuilt by the delta.
+    """
+
+    out = list()
+    for tag, i1, i2, j1, j2 in text.get_opcodes(base, target):
+        if tag == 'equal':
+            out.append('= %(start)i %(count)i' % {'start': i1,
+                                                  'count': i2 - i1})
+        elif j2 > j1:
+            out.append('+ %(count)i' % {'count': j2 - j1})
+            out.extend(target[j1:j2])
+
+    return out
+
+def apply(base, delta):
+    """
+    Returns the list of lines rebuilt by applying the delta to base.
+
+    :param base:
+        List of lines the delta applies to.
+    :param delta:
+        Delta returned by make().
+
+    :raise ValueError:
+        If the delta is malformed.
+    """
+
+    out = list()
+
+    n = 0
+    while n < len(delta):
+        fields = delta[n].split(' ')
+        n += 1
+
+        if fields[0] == '=' and len(fields) == 3:
+            start = int(fields[1])
+            out.extend(base[start:start + int(fields[2])])
+        elif fields[0] == '+' and len(fields) == 2:
+            count = int(fields[1])
+            out.extend(delta[n:n + count])
+            n += count
+        else:
+            raise ValueError('Malformed delta line: %(l)r.' % \
+                             {'l': delta[n - 1]})
+
+    return out
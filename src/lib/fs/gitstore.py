@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+#
+# Package: fs.gitstore
+#
+try:
+    import os
+    import fcntl
+    import logging
+    import threading
+    import subprocess
+
+    import backup
+except ImportError, e:
+    raise ImportError(str(e) +
+"""
+    A critical module could not be imported.
+""")
+
+
+__all__ = ['Repository', 'GitBackup']
+
+
+
+class Repository(object):
+    """
+    This class commits the backup files to a local git repository.
+
+    The repository is the root directory of the backup and diff directories.
+    Written and removed files are recorded and committed together, so the
+    history of every node is kept by git, packed and deduplicated, whatever
+    the retention policy applied to the directories.
+    """
+
+    # Only the backup and diff directories are versioned.
+    __excluded = ['/*', '!/backup/', '!/diff/', '.catalog', '.*.tmp']
+
+    # Number of paths given to a single git command.
+    __chunk = 256
+
+
+
+    def __init__(self, directory):
+        """
+        Repository constructor. The repository is created if it doesn't
+        exist.
+
+        :param directory:
+            Root directory of the repository.
+        """
+
+        self.directory = directory.rstrip(os.sep)
+        self.logger = logging.getLogger('nodesnap')
+
+        # Paths changed since the last commit, relative to the directory.
+        self.__paths = set()
+        self.__lock = threading.Lock()
+
+        if not os.path.exists(self.directory + os.sep + '.git'):
+            if not os.path.exists(self.directory):
+                os.makedirs(self.directory)
+            self.__git('init', '-q')
+
+            f = open(self.directory + os.sep + os.path.join('.git', 'info',
+                                                            'exclude'), 'w')
+            try:
+                f.write('\n'.join(self.__excluded) + '\n')
+            finally:
+                f.close()
+
+
+
+    def __git(self, *args):
+        """
+        Runs a git command in the repository and returns its exit status.
+
+        :raise OSError:
+            If the command fails with another status than 1.
+        """
+
+        command = ['git', '-c', 'user.name=nodesnap',
+                   '-c', 'user.email=nodesnap@localhost'] + list(args)
+
+        process = subprocess.Popen(command, cwd =self.directory,
+                                   stdout =subprocess.PIPE,
+                                   stderr =subprocess.STDOUT)
+        output = process.communicate()[0]
+        if process.returncode not in (0, 1):
+            raise OSError("'%(c)s' failed: %(o)s" % \
+                          {'c': ' '.join(args), 'o': output.strip()})
+
+        return process.returncode
+
+    def add(self, path):
+        """
+        Records a written or removed file, committed by the next commit().
+
+        :param path:
+            Path of the file.
+        """
+
+        self.__lock.acquire()
+        try:
+            self.__paths.add(os.path.relpath(path, self.directory))
+        finally:
+            self.__lock.release()
+
+    def commit(self, message):
+        """
+        Commits the recorded files and returns their number.
+
+        :param message:
+            Commit message.
+        """
+
+        self.__lock.acquire()
+        try:
+            paths = sorted(self.__paths)
+            self.__paths = set()
+        finally:
+            self.__lock.release()
+
+        if not paths:
+            return 0
+
+        # A file may have been written and removed between two commits, git
+        # never knew it: removed files are only unstaged if they are
+        # tracked.
+        existing = [path for path in paths \
+                    if os.path.lexists(self.directory + os.sep + path)]
+        missing  = [path for path in paths \
+                    if not os.path.lexists(self.directory + os.sep + path)]
+
+        # Other processes may commit to the repository at the same time.
+        lock = open(self.directory + os.sep + os.path.join('.git',
+                                                           'nodesnap.lock'),
+                    'w')
+        try:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+
+            for n in xrange(0, len(existing), self.__chunk):
+                self.__git('add', '-A', '--', *existing[n:n + self.__chunk])
+            for n in xrange(0, len(missing), self.__chunk):
+                self.__git('rm', '-q', '--cached', '--ignore-unmatch', '--',
+                           *missing[n:n + self.__chunk])
+
+            # Nothing is committed if the files didn't change.
+            if self.__git('diff', '--cached', '--quiet') == 0:
+                return 0
+
+            self.__git('commit', '-q', '--no-verify', '-m', message)
+        except Exception:
+            # The files are committed by the next commit.
+            self.__lock.acquire()
+            try:
+                self.__paths.update(paths)
+            finally:
+                self.__lock.release()
+            raise
+        finally:
+            lock.close()
+
+        self.logger.debug('%(n)i files committed to %(path)s.' % \
+                          {'n': len(paths), 'path': self.directory})
+
+        return len(paths)
+
+
+
+
+class GitBackup(backup.Backup):
+    """
+    This class manages backup files in a directory of a git repository (see
+    Repository). Files are written as with fs.backup.Backup and recorded in
+    the repository, the caller commits them.
+    """
+
+    def __init__(self, repository, root_directory, *args, **kwargs):
+        """
+        GitBackup constructor.
+
+        :param repository:
+            Repository object holding the directory.
+
+        Other arguments are given to fs.backup.Backup.
+        """
+
+        backup.Backup.__init__(self, root_directory, *args, **kwargs)
+
+        self.repository = repository
+        self.__root_directory = root_directory.rstrip(os.sep)
+
+
+
+    def _changed(self, filename):
+        """
+        Records the written or removed file in the repository.
+        """
+
+        self.repository.add(self.__root_directory + os.sep + filename)
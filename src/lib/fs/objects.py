@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+#
+# Package: fs.objects
+#
+try:
+    import os
+    import errno
+    import shutil
+except ImportError, e:
+    raise ImportError(str(e) +
+"""
+    A critical module could not be imported.
+""")
+
+
+__all__ = ['ObjectStore']
+
+
+
+class ObjectStore(object):
+    """
+    This class stores file contents once, keyed by their digest.
+
+    Backup files are hard links to the stored objects, so identical contents
+    share the same disk blocks whatever the number of nodes and runs. An
+    object is removed when no backup file links to it anymore.
+
+    If hard links are not supported, the object is copied instead.
+    """
+
+    def __init__(self, directory):
+        """
+        ObjectStore constructor.
+
+        :param directory:
+            Directory of the objects.
+        """
+
+        self.directory = directory
+
+
+
+    def get_path(self, digest):
+        """
+        Returns the path of the object with the given digest.
+        """
+
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def add(self, digest, path):
+        """
+        Moves the given file to the store as the object with the given
+        digest.
+
+        :param digest:
+            Digest of the file content.
+        :param path:
+            Path of the file, on the same file system as the store.
+        """
+
+        object_path = self.get_path(digest)
+
+        # Another process may create the directory at the same time.
+        try:
+            os.makedirs(os.path.dirname(object_path))
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        os.rename(path, object_path)
+
+    def link(self, digest, path):
+        """
+        Creates the given file from the object with the given digest.
+        Returns False if there is no such object.
+
+        :param digest:
+            Digest of the content.
+        :param path:
+            Path of the file to create.
+        """
+
+        object_path = self.get_path(digest)
+
+        try:
+            os.link(object_path, path)
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                return False
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK,
+                               errno.EOPNOTSUPP):
+                raise
+
+            shutil.copyfile(object_path, path)
+
+        return True
+
+    def release(self, digest):
+        """
+        Removes the object with the given digest if no file links to it
+        anymore.
+        """
+
+        object_path = self.get_path(digest)
+
+        try:
+            if os.stat(object_path).st_nlink <= 1:
+                os.unlink(object_path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+#
+# Package: fs.retention
+#
+try:
+    import time
+    import datetime
+except ImportError, e:
+    raise ImportError(str(e) +
+"""
+    A critical module could not be imported.
+""")
+
+
+__all__ = ['Policy']
+
+
+
+class Policy(object):
+    """
+    This class selects the files to remove from a backup directory.
+
+    A file is kept if it is one of the 'last' most recent files, or the most
+    recent file of one of the 'daily' last days, 'weekly' last weeks or
+    'monthly' last months having files (grandfather-father-son). Files older
+    than 'max_age' days are removed whatever the other rules. The most recent
+    file is always kept.
+
+    If no rule is given, every file is kept.
+
+    policy = Policy(last =5, daily =7, monthly =12)
+    obsolete = policy.select(catalog.files())
+    """
+
+    def __init__(self, last =None, daily =None, weekly =None, monthly =None,
+                 max_age =None):
+        """
+        Policy constructor.
+
+        :param last:
+            Number of most recent files to keep.
+        :param daily:
+            Number of days to keep a file for.
+        :param weekly:
+            Number of weeks to keep a file for.
+        :param monthly:
+            Number of months to keep a file for.
+        :param max_age:
+            Maximum age of the files, in days.
+        """
+
+        self.last    = last
+        self.daily   = daily
+        self.weekly  = weekly
+        self.monthly = monthly
+        self.max_age = max_age
+
+
+
+    def is_empty(self):
+        """
+        Returns True if the policy keeps every file.
+        """
+
+        return not (self.last or self.daily or self.weekly or self.monthly \
+                    or self.max_age)
+
+    def __keep_periods(self, files, count, period):
+        """
+        Returns the names of the most recent file of the 'count' last
+        periods.
+
+        :param files:
+            List of (filename, timestamp, ...) tuples, most recent first.
+        :param period:
+            Function returning the period of a timestamp.
+        """
+
+        kept = set()
+        last_period = None
+        for entry in files:
+            if len(kept) >= count:
+                break
+
+            current = period(entry[1])
+            if current != last_period:
+                kept.add(entry[0])
+                last_period = current
+
+        return kept
+
+    def select(self, files, now =None):
+        """
+        Returns the names of the files to remove, oldest first.
+
+        :param files:
+            List of (filename, timestamp, ...) tuples, oldest first, as
+            returned by Catalog.files().
+        :param now:
+            Current time, in seconds since the epoch.
+        """
+
+        if self.is_empty() or len(files) < 2:
+            return list()
+
+        if now is None:
+            now = time.time()
+
+        # Nothing to do if only the number of files is limited and it is
+        # not reached.
+        if self.max_age is None and not (self.daily or self.weekly or \
+                                         self.monthly) and \
+           len(files) <= self.last:
+            return list()
+
+        newest = list(reversed(files))
+
+        kept = set([newest[0][0]])
+        if self.daily or self.weekly or self.monthly or self.last:
+            kept.update([entry[0] for entry in newest[:self.last or 0]])
+
+            day = datetime.date.fromtimestamp
+            if self.daily:
+                kept.update(self.__keep_periods(newest, self.daily, day))
+            if self.weekly:
+                kept.update(self.__keep_periods(newest, self.weekly,
+                    lambda t: day(t).isocalendar()[:2]))
+            if self.monthly:
+                kept.update(self.__keep_periods(newest, self.monthly,
+                    lambda t: (day(t).year, day(t).month)))
+        else:
+            # Only the maximum age is set.
+            kept.update([entry[0] for entry in files])
+
+        if self.max_age is not None:
+            limit = now - self.max_age * 86400
+            kept = set([entry[0] for entry in newest[1:] \
+                        if entry[0] in kept and entry[1] >= limit])
+            kept.add(newest[0][0])
+
+        return [entry[0] for entry in files if entry[0] not in kept]
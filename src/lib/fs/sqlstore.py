@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+#
+# Package: fs.sqlstore
+#
+try:
+    import os
+    import bz2
+    import time
+    import zlib
+    import errno
+    import logging
+    import sqlite3
+    import cStringIO
+
+    import backup
+    import storage
+except ImportError, e:
+    raise ImportError(str(e) +
+"""
+    A critical module could not be imported.
+""")
+
+
+__all__ = ['Database', 'SQLiteBackup']
+
+
+
+# Compression formats: name -> (compress, decompress).
+_compressions = {'gzip': (zlib.compress, zlib.decompress),
+                 'bz2':  (bz2.compress, bz2.decompress)}
+
+
+
+class Database(object):
+    """
+    This class holds the connection to the SQLite database of the
+    SQLiteBackup objects.
+
+    Every file of every directory is a row of a single table, indexed by
+    directory and date. The database is shared by the threads of a process,
+    their calls must be serialized. Several processes may use it at the
+    same time, a process waits for the others to commit.
+    """
+
+    __schema = ("""CREATE TABLE IF NOT EXISTS files (
+                       directory   TEXT NOT NULL,
+                       filename    TEXT NOT NULL,
+                       timestamp   REAL NOT NULL,
+                       size        INTEGER NOT NULL,
+                       digest      TEXT,
+                       compression TEXT,
+                       content     BLOB NOT NULL,
+                       PRIMARY KEY (directory, filename))""",
+                """CREATE INDEX IF NOT EXISTS files_date
+                       ON files (directory, timestamp, filename)""")
+
+
+
+    def __init__(self, path, autocommit =True):
+        """
+        Database constructor.
+
+        :param path:
+            Path of the database file, created if it doesn't exist.
+        :param autocommit:
+            Commit after each write. Otherwise, written files are only saved
+            when commit() is called.
+        """
+
+        self.path = path
+        self.autocommit = autocommit
+
+        # Another process may create the directory at the same time.
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        self.connection = sqlite3.connect(path, timeout =60,
+                                          check_same_thread =False)
+        self.connection.text_factory = str
+
+        # Readers don't wait for the writers.
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        for statement in self.__schema:
+            self.connection.execute(statement)
+        self.connection.commit()
+
+
+
+    def execute(self, statement, parameters =()):
+        """
+        Executes the given statement and returns the cursor.
+        """
+
+        return self.connection.execute(statement, parameters)
+
+    def executemany(self, statement, parameters):
+        """
+        Executes the given statement for each item of parameters.
+        """
+
+        return self.connection.executemany(statement, parameters)
+
+    def written(self):
+        """
+        Called after each write, commits unless autocommit is disabled.
+        """
+
+        if self.autocommit:
+            self.connection.commit()
+
+    def commit(self):
+        """
+        Saves the written files.
+        """
+
+        self.connection.commit()
+
+    def close(self):
+        """
+        Commits and closes the connection.
+        """
+
+        self.connection.commit()
+        self.connection.close()
+
+
+
+
+class SQLiteBackup(storage.Storage):
+    """
+    This class manages the backup files of a directory stored in a SQLite
+    database (see Database).
+
+    The directory is only a key: nothing is written outside the database
+    file, so there is neither directory nor catalog to maintain whatever the
+    number of nodes. Files have the same names and are read back as with
+    fs.backup.Backup.
+    """
+
+    def __init__(self, database, directory, compression =None):
+        """
+        SQLiteBackup constructor.
+
+        :param database:
+            Database object.
+        :param directory:
+            Name of the directory, for instance 'backup/node'.
+        :param compression:
+            Compression of the stored files, 'gzip' or 'bz2'. Files are
+            stored as plain text if it is None.
+        """
+
+        if compression is not None and compression not in _compressions:
+            raise ValueError("Unknown compression '%(c)s'." % \
+                             {'c': compression})
+
+        self.database = database
+        self.directory = directory.rstrip('/')
+        self.compression = compression
+        self.logger = logging.getLogger('nodesnap')
+
+
+
+    def __get_path(self, filename):
+        """
+        Returns the displayed path of a file.
+        """
+
+        return self.directory + '/' + filename
+
+    def __latest(self):
+        """
+        Returns the (filename, digest) tuple of the most recent file, or None.
+        """
+
+        return self.database.execute(
+                   'SELECT filename, digest FROM files WHERE directory = ? '
+                   'ORDER BY timestamp DESC, filename DESC LIMIT 1',
+                   (self.directory, )).fetchone()
+
+    def get_filenames_list(self):
+        """
+        Returns the names of the files of the directory.
+        """
+
+        return [row[0] for row in self.database.execute(
+                    'SELECT filename FROM files WHERE directory = ?',
+                    (self.directory, ))]
+
+    def get_most_recent_filename(self, pattern =None):
+        """
+        Returns most recent backup file's name.
+        """
+
+        latest = self.__latest()
+        if latest is None:
+            return None
+
+        return self.__get_path(latest[0])
+
+    def get_most_recent_file_content(self, pattern =None):
+        """
+        Returns most recent backup file's content.
+        """
+
+        latest = self.__latest()
+        if latest is None:
+            return list()
+
+        return self.read(latest[0])
+
+    def iter_most_recent_file_content(self, pattern =None):
+        """
+        Returns an iterator on the most recent backup file's content.
+        """
+
+        latest = self.__latest()
+        if latest is None:
+            return iter(())
+
+        return self.__iter_lines(latest[0])
+
+    def read(self, filename):
+        """
+        Returns the content of a file of the directory.
+
+        :param filename:
+            File name, as returned by write().
+
+        :raise IOError:
+            If there is no such file.
+        """
+
+        return list(self.__iter_lines(filename))
+
+    def __iter_lines(self, filename):
+        """
+        Returns an iterator on the lines of a file of the directory, split
+        as when a file is read.
+        """
+
+        row = self.database.execute(
+                  'SELECT compression, content FROM files '
+                  'WHERE directory = ? AND filename = ?',
+                  (self.directory, filename)).fetchone()
+        if row is None:
+            raise IOError("%(path)s: no such file." % \
+                          {'path': self.__get_path(filename)})
+
+        data = str(row[1])
+        if row[0] is not None:
+            data = _compressions[row[0]][1](data)
+
+        return (line.rstrip(backup._blanks) \
+                for line in cStringIO.StringIO(data))
+
+    def get_last_digest(self, pattern =None):
+        """
+        Returns a (digest, path) tuple for the most recent file, or
+        (None, None) if its digest is unknown.
+        """
+
+        latest = self.__latest()
+        if latest is None or latest[1] is None:
+            return (None, None)
+
+        return (latest[1], self.__get_path(latest[0]))
+
+    def set_last_digest(self, filename, value):
+        """
+        Records the digest of a file of the directory.
+        """
+
+        self.database.execute('UPDATE files SET digest = ? '
+                              'WHERE directory = ? AND filename = ?',
+                              (value, self.directory, filename))
+        self.database.written()
+
+    def rebuild_catalog(self, pattern =None):
+        """
+        The database is its own index, returns the number of files.
+        """
+
+        return self.database.execute(
+                   'SELECT COUNT(*) FROM files WHERE directory = ?',
+                   (self.directory, )).fetchone()[0]
+
+
+
+    def apply_retention(self, policy):
+        """
+        Remove the files selected by the given retention policy and returns
+        their number.
+
+        :param policy:
+            fs.retention.Policy object.
+        """
+
+        if policy.is_empty():
+            return 0
+
+        entries = self.database.execute(
+                      'SELECT filename, timestamp, size, digest FROM files '
+                      'WHERE directory = ? ORDER BY timestamp, filename',
+                      (self.directory, )).fetchall()
+        obsolete = policy.select(entries)
+        if not obsolete:
+            return 0
+
+        self.database.executemany('DELETE FROM files '
+                                  'WHERE directory = ? AND filename = ?',
+                                  [(self.directory, f) for f in obsolete])
+        self.database.written()
+
+        self.logger.info('%(path)s: %(n)i old files removed.' % \
+                         {'path': self.directory, 'n': len(obsolete)})
+
+        return len(obsolete)
+
+    def write(self, filename, content):
+        """
+        Stores the given content and returns the name of the stored file.
+
+        :param filename:
+            File name.
+        :param content:
+            File content, any iterable of lines.
+        """
+
+        content = list(content)
+        data = '\n'.join(content)
+        if self.compression is not None:
+            data = _compressions[self.compression][0](data)
+
+        self.database.execute('INSERT OR REPLACE INTO files VALUES '
+                              '(?, ?, ?, ?, ?, ?, ?)',
+                              (self.directory, filename, time.time(),
+                               len(data), backup.digest(content),
+                               self.compression, buffer(data)))
+        self.database.written()
+
+        self.logger.info('%(path)s written.' % \
+                         {'path': self.__get_path(filename)})
+
+        return filename
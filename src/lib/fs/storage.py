@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+# Package: fs.storage
+#
+try:
+    import retention
+except ImportError, e:
+    raise ImportError(str(e) +
+"""
+    A critical module could not be imported.
+""")
+
+
+__all__ = ['Storage']
+
+
+
+class Storage(object):
+    """
+    Interface of the storage backends.
+
+    A storage object manages the files of one node directory: backups or
+    diffs. Files are given a name when they are written and are read back
+    as lists of lines without their trailing blanks. The backends are:
+
+    - fs.backup.Backup, files in a directory tree;
+    - fs.sqlstore.SQLiteBackup, a single SQLite database;
+    - fs.gitstore.GitBackup, files in a local git repository.
+    """
+
+    def get_most_recent_filename(self, pattern =None):
+        """
+        Returns the path of the most recent file, or None if there is no
+        file.
+
+        :param pattern:
+            Date pattern of the file names, used by backends which have to
+            sort the files by name.
+        """
+
+        raise NotImplementedError()
+
+    def get_most_recent_file_content(self, pattern =None):
+        """
+        Returns the content of the most recent file, or an empty list if
+        there is no file.
+        """
+
+        raise NotImplementedError()
+
+    def iter_most_recent_file_content(self, pattern =None):
+        """
+        Returns an iterator on the content of the most recent file. Backends
+        which can read a file line by line override it to avoid building the
+        whole content.
+        """
+
+        return iter(self.get_most_recent_file_content(pattern))
+
+    def get_last_digest(self, pattern =None):
+        """
+        Returns a (digest, path) tuple for the most recent file, or
+        (None, None) if its digest is unknown. See fs.backup.digest().
+        """
+
+        raise NotImplementedError()
+
+    def set_last_digest(self, filename, value):
+        """
+        Records the digest of a file.
+        """
+
+        raise NotImplementedError()
+
+    def read(self, filename):
+        """
+        Returns the content of the given file.
+
+        :param filename:
+            File name, as returned by write().
+
+        :raise IOError:
+            If there is no such file.
+        """
+
+        raise NotImplementedError()
+
+    def write(self, filename, content):
+        """
+        Stores the given content and returns the name of the stored file.
+        A file with the same name is replaced.
+
+        :param filename:
+            File name.
+        :param content:
+            File content, any iterable of lines.
+        """
+
+        raise NotImplementedError()
+
+    def apply_retention(self, policy):
+        """
+        Removes the files selected by the given retention policy and returns
+        their number.
+
+        :param policy:
+            fs.retention.Policy object.
+        """
+
+        raise NotImplementedError()
+
+    def rotate(self, n):
+        """
+        Remove oldest files.
+
+        :param n:
+            Number of files to keep.
+        """
+
+        return self.apply_retention(retention.Policy(last =n))
+
+    def rebuild_catalog(self, pattern =None):
+        """
+        Rebuilds the index of the files, if the backend has one, and returns
+        the number of files.
+        """
+
+        raise NotImplementedError()
@@ -3,4 +3,4 @@
 # Package: net
 #
 
-__all__ = ['connect', 'mail', 'node']
\ No newline at end of file
+__all__ = ['connect', 'mail', 'node', 'reactor']
\ No newline at end of file
@@ -4,7 +4,14 @@
 #
 try:
     import re
+    import os
+    import stat
+    import time
+    import errno
+    import socket
     import pexpect
+
+    import reactor
 except ImportError, e:
     raise ImportError(str(e) +
 """
@@ -12,7 +19,7 @@ except ImportError, e:
 """)
 
 
-__all__ = ['SSH', 'Telnet']
+__all__ = ['SSH', 'Telnet', 'LineParser', 'clean_control_directory']
 
 
 
@@ -27,6 +34,14 @@ class Connect(object):
     default_login_str = re.compile('(username|login)\s?:', re.I)
     default_password_str = re.compile('password\s?:', re.I)
 
+    # Lignes complètes reçues.
+    lines = re.compile('(?:[^\n]*\n)+')
+
+    # pexpect attend par défaut 50 ms avant chaque envoi, ce qui bloquerait
+    # toutes les sessions du réacteur. On attend toujours le prompt ou la
+    # demande avant d'envoyer quoi que ce soit, ce délai est donc inutile.
+    delaybeforesend = 0
+
 
 
     def __init__(self, hostname, username, password =None, prompt =None,
@@ -57,6 +72,13 @@ class Connect(object):
 
         self.child.close()
 
+    def is_alive(self):
+        """
+        Renvoi si la connexion est toujours ouverte.
+        """
+
+        return self.child is not None and self.child.isalive()
+
     def interact(self):
         """
         Cette méthode permet de rendre la main à l'utilisateur.
@@ -64,14 +86,67 @@ class Connect(object):
 
         self.child.interact()
 
+    def expect_task(self, pattern):
+        """
+        Tâche attendant l'un des éléments passés en paramètre sans bloquer
+        le réacteur. Elle renvoi l'indice de l'élément trouvé.
+
+        @param pattern:
+            Elément(s) attendu(s), comme pour pexpect.spawn.expect.
+
+        @raise pexpect.TIMEOUT:
+            Si rien n'est trouvé avant l'expiration du délai.
+        """
+
+        # Les éléments ne sont compilés qu'une fois.
+        pattern = self.child.compile_pattern_list(pattern)
+
+        # Sans délai, on attend indéfiniment.
+        end = None
+        if self.timeout is not None:
+            end = time.time() + self.timeout
+
+        while True:
+            try:
+                # On ne lit que les données déjà disponibles.
+                ret = self.child.expect_list(pattern, timeout =0)
+            except pexpect.TIMEOUT:
+                remaining = None
+                if end is not None:
+                    remaining = end - time.time()
+                    if remaining <= 0:
+                        raise
+
+                try:
+                    yield reactor.Wait(self.child.child_fd, remaining)
+                except reactor.Timeout:
+                    raise pexpect.TIMEOUT('Timeout exceeded.')
+
+                continue
+
+            yield reactor.Return(ret)
+
     def run(self, command, expected =None):
         """
         Cette méthode exécute la commande passée en paramètre et renvoi son
         résultat.
+
+        Voir run_task.
+        """
+
+        return reactor.call(self.run_task(command, expected))
+
+    def run_task(self, command, expected =None, skip =1):
+        """
+        Tâche exécutant la commande passée en paramètre et renvoyant son
+        résultat.
         
         L'utilisateur peut spécifier des éléments attendues avant le prompt
         et les actions à effectuer.
 
+        Chaque ligne est nettoyée dès sa réception : les espaces en fin de
+        ligne sont enlevés et les lignes vides sont ignorées.
+
 
         @param command:
             Commande à exécuter.
@@ -82,6 +157,12 @@ class Connect(object):
             Elément(s) attendu durant l'exécution de la commande.
         @type expected:
             dict
+
+        @param skip:
+            Nombre de lignes ignorées au début du résultat. La première
+            ligne contient la commande.
+        @type skip:
+            int
         
         @raise TypeError:
             Raises TypeError if 'expected' parameter is not a dictionnary.
@@ -100,44 +181,84 @@ class Connect(object):
 
             expected_list = expected.keys()
 
+        parser = LineParser(out.append, skip)
+
+        # Les lignes complètes sont le premier élément : elles sont traitées
+        # dès leur réception et ne restent pas dans le tampon de pexpect. Le
+        # prompt et les éléments attendus ne sont donc recherchés que dans
+        # la dernière ligne, incomplète.
+        pattern = [self.lines, self.prompt] + expected_list
+
         # On exécute la commande
         self.child.sendline(command)
 
         # On boucle tant que l'on a pas le prompt..
-        ret = -1
-        while ret != 0:
-            # Si la liste des éléments attendus est spécifiée,
-            # on l'ajoute.
-            if expected is not None:
-                ret = self.child.expect([self.prompt, ', '.join(expected_list)])
-            else:
-                ret = self.child.expect(self.prompt)
+        while True:
+            ret = yield self.expect_task(pattern)
+
+            if ret == 0:
+                parser.feed(self.child.before + self.child.after)
+                continue
+
+            parser.feed(self.child.before)
+
+            if ret == 1:
+                break
+
+            # Si la valeur de retour correspond à un élément attendu,
+            # on envoi la commande correspondante.
+            self.child.send(expected[expected_list[ret - 2]])
 
-            if re.search('[\b\n\r]', self.child.before):
-                # Puis, on sépare chaque ligne.
-                for line in re.split('[\b\n\r]', self.child.before):
-                    # On enlève les espace éventuels en fin de ligne.
-                    line = re.sub('[\b\s\n\r]*$', '', line)
 
-                    # On ajoute chaque ligne dans la liste de retour si celle-ci
-                    # n'est pas vide ou ne possède pas que des espaces.
-                    if not re.search('^[\b\s\n]*$', line):
-                        out.append(line)
-            else:
-                out.append(re.sub('[\b\s\n\r]*$', '', self.child.before))
+        yield reactor.Return(out)
 
-            # Si la valeur de retour est différente de celle correspondant
-            # au prompt, 0.
-            # On envoi la commande correspondant à l'élément trouvé.
-            if ret != 0:
-                self.child.send(expected[expected_list[ret - 1]])
 
-        # La première ligne contient la commande et la dernière le prompt.
-        # Donc on les enlève.
-        out.pop(0)
 
 
-        return out
+class LineParser(object):
+    """
+    Découpe en lignes nettoyées le texte reçu d'une session.
+    """
+
+    # Séparateurs de lignes.
+    __separators = re.compile('[\b\n\r]')
+    # Caractères enlevés en fin de ligne.
+    __blanks = '\b \t\n\r\f\v'
+
+
+
+    def __init__(self, consumer, skip =0):
+        """
+        Constructeur de la classe LineParser.
+
+        @param consumer:
+            Fonction appelée avec chaque ligne.
+
+        @param skip:
+            Nombre de lignes à ignorer au début.
+        """
+
+        self.consumer = consumer
+        self.skip = skip
+
+
+
+    def feed(self, text):
+        """
+        Découpe le texte passé en paramètre et transmet chaque ligne non
+        vide, sans les espaces de fin de ligne.
+        """
+
+        for line in self.__separators.split(text):
+            line = line.rstrip(self.__blanks)
+            if not line:
+                continue
+
+            if self.skip:
+                self.skip -= 1
+                continue
+
+            self.consumer(line)
 
 
 
@@ -152,16 +273,68 @@ class SSH(Connect):
     __kb_interractive  = "%(username)s's password for keyboard-interactive method:"
     __exchange_id_conn_closed = "ssh_exchange_identification: Connection closed by remote host"
 
+    # Options OpenSSH du multiplexage. %C est le condensat de l'utilisateur,
+    # de l'hôte et du port (OpenSSH 6.7 ou plus récent) : le chemin reste
+    # court quelle que soit la longueur du nom d'hôte.
+    __control_options = '-o ControlMaster=auto -o ControlPath=%(path)s -o ControlPersist=%(persist)i'
+    __control_path = '%C'
+
 
 
     def __init__(self, hostname, username, password =None, prompt =None,
-                 timeout =15):
+                 timeout =15, control_directory =None, control_persist =600):
         """
         Constructeur de la classe SSH.
+
+        @param control_directory:
+            Répertoire des sockets de contrôle OpenSSH. S'il est spécifié,
+            la connexion passe par un maître persistant par hôte : seule la
+            première connexion s'authentifie, les suivantes réutilisent son
+            canal.
+
+        @param control_persist:
+            Durée en secondes pendant laquelle le maître reste actif après
+            la dernière session.
         """
 
         Connect.__init__(self, hostname, username, password, prompt, timeout)
 
+        self.control_directory = control_directory
+        self.control_persist   = control_persist
+
+
+
+    def get_control_options(self):
+        """
+        Retourne les options de multiplexage à passer à ssh.
+        """
+
+        if self.control_directory is None:
+            return ''
+
+        return self.__control_options % \
+               {
+                'path': os.path.join(self.control_directory,
+                                     self.__control_path),
+                'persist': self.control_persist
+               }
+
+    def exit_master(self):
+        """
+        Cette méthode arrête le maître persistant de l'hôte s'il existe.
+        """
+
+        if self.control_directory is None:
+            return
+
+        pexpect.run('ssh %(options)s -O exit %(username)s@%(hostname)s' % \
+                    {
+                     'options': self.get_control_options(),
+                     'username': self.username,
+                     'hostname': self.hostname
+                    },
+                    timeout = self.timeout)
+
 
 
     def login(self):
@@ -169,18 +342,27 @@ class SSH(Connect):
         Cette méthode établi la connexion avec l'hôte.
         """
 
-        self.child = pexpect.spawn('ssh %(username)s@%(hostname)s' % \
+        return reactor.call(self.login_task())
+
+    def login_task(self):
+        """
+        Tâche établissant la connexion avec l'hôte.
+        """
+
+        self.child = pexpect.spawn('ssh %(options)s %(username)s@%(hostname)s' % \
                                    {
+                                    'options': self.get_control_options(),
                                     'username': self.username,
                                     'hostname': self.hostname
                                    },
                                    timeout = self.timeout)
+        self.child.delaybeforesend = self.delaybeforesend
 
         # Tant que l'on a pas le prompt, on considère que l'on est pas loggué.
         while True:
             try:
                 # On liste toutes les possibilités.
-                ret = self.child.expect([
+                ret = yield self.expect_task([
                                          self.__first_connection,
 
                                          self.default_login_str,
@@ -210,14 +392,14 @@ class SSH(Connect):
 
                 if ret == 5:
                     # On a le prompt.
-                    return True
+                    yield reactor.Return(True)
 
                 if ret == 6:
-                    return False
+                    yield reactor.Return(False)
             except pexpect.TIMEOUT:
-                return False
+                yield reactor.Return(False)
             except pexpect.EOF:
-                return False
+                yield reactor.Return(False)
 
 
 
@@ -245,6 +427,13 @@ class Telnet(Connect):
         Cette méthode établi la connexion avec l'hôte.
         """
 
+        return reactor.call(self.login_task(port))
+
+    def login_task(self, port = 23):
+        """
+        Tâche établissant la connexion avec l'hôte.
+        """
+
         try:
             self.child = pexpect.spawn('telnet -l %(username)s %(hostname)s %(port)i' % \
                                        {
@@ -253,11 +442,12 @@ class Telnet(Connect):
                                         'port': port
                                        },
                                        timeout = self.timeout)
+            self.child.delaybeforesend = self.delaybeforesend
 
             # Tant que l'on a pas le prompt, on considère que l'on est pas loggué.
             while True:
                 # On liste toutes les possibilités.
-                ret = self.child.expect([
+                ret = yield self.expect_task([
                                          self.default_login_str,
 
                                          self.default_password_str,
@@ -277,8 +467,52 @@ class Telnet(Connect):
 
                 if ret == 2:
                     # On a le prompt.
-                    return True
+                    yield reactor.Return(True)
         except pexpect.TIMEOUT:
-            return False
+            yield reactor.Return(False)
         except pexpect.EOF:
-            return False
+            yield reactor.Return(False)
+
+
+
+
+def clean_control_directory(directory):
+    """
+    Supprime les sockets de contrôle dont le maître n'existe plus et renvoi
+    leur nombre.
+
+    @param directory:
+        Répertoire des sockets de contrôle.
+    """
+
+    removed = 0
+
+    if not os.path.isdir(directory):
+        return removed
+
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+
+        try:
+            if not stat.S_ISSOCK(os.lstat(path).st_mode):
+                continue
+        except OSError:
+            continue
+
+        # Un maître actif accepte la connexion.
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            try:
+                sock.connect(path)
+            except socket.error, e:
+                if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+                    try:
+                        os.unlink(path)
+                        removed += 1
+                    except OSError:
+                        pass
+        finally:
+            sock.close()
+
+
+    return removed
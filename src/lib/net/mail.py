@@ -5,8 +5,10 @@
 import sys
 
 try:
+    import socket
     import logging
     import smtplib
+    import threading
 
     if (sys.version_info < (2, 5)):
         from email.MIMEText import MIMEText
@@ -20,7 +22,158 @@ except ImportError, e:
 """)
 
 
-__all__ = ['Mail']
+__all__ = ['Transport', 'Mail']
+
+
+
+class Transport(object):
+    """
+    Classe gardant une connexion SMTP ouverte par serveur, pour envoyer tous
+    les e-mails d'une exécution sans ouvrir une session par e-mail.
+
+    Une connexion est rouverte quand le serveur l'a fermée et après un
+    nombre maximum d'e-mails. Les e-mails d'un même serveur sont envoyés les
+    uns après les autres.
+
+    transport = Transport()
+    Mail(...).send(transport)
+    transport.close()
+    """
+
+    def __init__(self, max_messages =100):
+        """
+        Constructeur de la classe Transport.
+
+        @param max_messages:
+            Nombre maximum d'e-mails envoyés par une connexion avant de la
+            rouvrir.
+        """
+
+        self.max_messages = max_messages
+
+        # serveur -> [connexion, nombre d'e-mails envoyés]
+        self.__connections = dict()
+        # serveur -> verrou de la connexion
+        self.__locks = dict()
+        self.__lock = threading.Lock()
+
+        self.logger = logging.getLogger('nodesnap')
+
+
+
+    def __get_lock(self, server):
+        """
+        Retourne le verrou de la connexion au serveur donné.
+        """
+
+        self.__lock.acquire()
+        try:
+            if server not in self.__locks:
+                self.__locks[server] = threading.Lock()
+
+            return self.__locks[server]
+        finally:
+            self.__lock.release()
+
+    def __quit(self, server):
+        """
+        Ferme la connexion au serveur donné. Les erreurs sont ignorées : le
+        serveur a pu fermer la connexion de lui-même.
+        """
+
+        smtp, count = self.__connections.pop(server, (None, 0))
+        if smtp is None:
+            return
+
+        try:
+            smtp.quit()
+        except (smtplib.SMTPException, socket.error):
+            smtp.close()
+
+        self.logger.debug('Mail server %(s)s: connection closed after %(n)i e-mails.' % \
+                          {'s': server, 'n': count})
+
+    def __connect(self, server):
+        """
+        Retourne la connexion au serveur donné, ouverte si besoin.
+        """
+
+        connection = self.__connections.get(server)
+        if connection is not None and connection[1] >= self.max_messages:
+            self.__quit(server)
+            connection = None
+
+        if connection is None:
+            self.logger.debug('Mail server %(s)s: connecting.' % {'s': server})
+            connection = [smtplib.SMTP(server), 0]
+            self.__connections[server] = connection
+
+        return connection
+
+    def send(self, server, sender, recipients, message):
+        """
+        Envoie un e-mail par la connexion au serveur donné.
+
+        Si la connexion a été fermée par le serveur, elle est rouverte et
+        l'e-mail est envoyé une seconde fois.
+
+        @param server:
+            Adresse du serveur SMTP.
+        @param sender:
+            Adresse de l'émetteur.
+        @param recipients:
+            Liste des adresses des destinataires.
+        @param message:
+            E-mail complet, en-têtes compris.
+        """
+
+        lock = self.__get_lock(server)
+        lock.acquire()
+        try:
+            for attempt in (1, 2):
+                connection = self.__connect(server)
+                try:
+                    connection[0].sendmail(sender, recipients, message)
+                except (smtplib.SMTPServerDisconnected, socket.error):
+                    # La connexion n'est plus utilisable.
+                    self.__connections.pop(server, None)
+                    connection[0].close()
+                    if attempt == 2:
+                        raise
+                    continue
+                except smtplib.SMTPResponseException, e:
+                    # 421 : le serveur ferme la connexion.
+                    if e.smtp_code != 421:
+                        raise
+                    self.__quit(server)
+                    if attempt == 2:
+                        raise
+                    continue
+
+                connection[1] += 1
+                return
+        finally:
+            lock.release()
+
+    def close(self):
+        """
+        Ferme toutes les connexions.
+        """
+
+        self.__lock.acquire()
+        try:
+            servers = self.__connections.keys()
+        finally:
+            self.__lock.release()
+
+        for server in servers:
+            lock = self.__get_lock(server)
+            lock.acquire()
+            try:
+                self.__quit(server)
+            finally:
+                lock.release()
+
 
 
 
@@ -175,9 +328,13 @@ class Mail(object):
         return self._server
 
 
-    def send(self):
+    def send(self, transport =None):
         """
         Sends and e-mail.
+
+        @param transport:
+            Transport object whose connection is used. A connection is opened
+            for this e-mail only if it is None.
         """
 
         mail = MIMEText(self.get_message())
@@ -191,6 +348,11 @@ class Mail(object):
                          {'s': self.get_subject(),
                           't': ', '.join(self.get_recipient())})
 
+        if transport is not None:
+            transport.send(self.get_server(), self.get_sender(),
+                           self.get_recipient(), mail.as_string())
+            return
+
         smtp = smtplib.SMTP(self.get_server())
         smtp.sendmail(self.get_sender(), self.get_recipient(), mail.as_string())
         smtp.quit()
@@ -5,6 +5,7 @@
 try:
     import re
     import connect
+    import reactor
     import util.text
 except ImportError, e:
     raise ImportError(str(e) +
@@ -44,6 +45,9 @@ class Node(object):
         
         self.timeout  = timeout
 
+        self.control_directory = None
+        self.control_persist   = None
+
 
         if prompt is not None:
             self.prompt = prompt
@@ -59,27 +63,94 @@ class Node(object):
             self.mode = mode
 
 
+    def set_control(self, directory, persist =600):
+        """
+        Active le multiplexage des connexions SSH.
+
+        @param directory:
+            Répertoire des sockets de contrôle OpenSSH.
+
+        @param persist:
+            Durée en secondes pendant laquelle le maître reste actif.
+        """
+
+        self.control_directory = directory
+        self.control_persist   = persist
+
+
     def connect(self):
         """
         Etabli une connection en fonction du mode choisi.
         """
 
+        return reactor.call(self.connect_task())
+
+    def connect_task(self):
+        """
+        Tâche établissant une connection en fonction du mode choisi.
+        """
+
         if self.mode == 'ssh':
             self.connection = connect.SSH(self.hostname, self.username,
                                           self.password, self.prompt,
-                                          self.timeout)
+                                          self.timeout,
+                                          self.control_directory,
+                                          self.control_persist)
         if self.mode == 'telnet':
             self.connection = connect.Telnet(self.hostname, self.username,
                                              self.password, self.prompt,
                                              self.timeout)
 
-        return self.connection.login()
+        if (yield self.connection.login_task()):
+            # Sans pagination, une commande est lue d'un seul tenant au lieu
+            # d'un aller-retour par page.
+            yield self.disable_paging_task()
+            yield reactor.Return(True)
+
+        yield reactor.Return(False)
+
+    def disable_paging_task(self):
+        """
+        Tâche désactivant la pagination des sorties pour la session.
+
+        Par défaut, rien n'est envoyé. La gestion des invites de pagination
+        reste en place si la commande n'est pas acceptée par l'hôte.
+        """
+
+        yield reactor.Return(None)
 
     def quit(self):
         self.connection.close()
 
+    def is_alive(self):
+        """
+        Renvoi si la connexion avec l'hôte est toujours ouverte.
+        """
+
+        return self.connection is not None and self.connection.is_alive()
+
     def run(self, command, expected =None):
-        return self.connection.run(command, expected)
+        return reactor.call(self.run_task(command, expected))
+
+    def run_task(self, command, expected =None, skip =1):
+        return self.connection.run_task(command, expected, skip)
+
+    def get_config(self, refresh =False, clear_comments =False):
+        """
+        Récupère la configuration courrante de l'hôte.
+        """
+
+        return reactor.call(self.get_config_task(refresh, clear_comments))
+
+    def get_hostname_task(self):
+        """
+        Tâche retournant le nom d'hôte du système.
+
+        Par défaut, le nom d'hôte est lu dans la configuration déjà
+        récupérée.
+        """
+
+        yield reactor.Return(self.get_hostname())
 
 
 
@@ -95,6 +166,8 @@ class Cisco(Node):
     __more = ' --More-- '
     __password = re.compile('password:', re.I)
 
+    __no_paging = 'terminal length 0'
+
     __show_config = 'show running-config'
     __show_privilege = 'show privilege'
 
@@ -127,48 +200,71 @@ class Cisco(Node):
         Etabli une connection en fonction du mode choisi.
         """
 
-        if Node.connect(self):
-            self.__level = self.get_privilege_level()
-            return True
+        return reactor.call(self.connect_task())
 
-        return False
+    def connect_task(self):
+        """
+        Tâche établissant une connection en fonction du mode choisi.
+        """
+
+        if (yield Node.connect_task(self)):
+            self.__level = yield self.get_privilege_level_task()
+            yield reactor.Return(True)
+
+        yield reactor.Return(False)
 
     def enable(self, level =15, password =None):
         """
         Cette méthode élève les privilèges de l'utilisateur.
         """
 
+        reactor.call(self.enable_task(level, password))
+
+    def enable_task(self, level =15, password =None):
+        """
+        Tâche élevant les privilèges de l'utilisateur.
+        """
+
         enable_password = self.password
         if password is not None:
             enable_password = password
 
-        self.connection.run(self.__enable % {'level': level},
-                            {self.__more: ' ',
-                             self.__password: enable_password})
+        return self.connection.run_task(self.__enable % {'level': level},
+                                        {self.__more: ' ',
+                                         self.__password: enable_password})
 
-    def run(self, command, expected =None):
+    def run_task(self, command, expected =None, skip =1):
         if expected is None:
             expected = {}
         expected[self.__more] = ' '
 
-        return Node.run(self, command, expected)
+        return Node.run_task(self, command, expected, skip)
 
+    def disable_paging_task(self):
+        """
+        Tâche désactivant la pagination des sorties pour la session.
+        """
 
-    def get_config(self, refresh =False, clear_comments =False):
+        return self.run_task(self.__no_paging)
+
+
+    def get_config_task(self, refresh =False, clear_comments =False):
         """
-        Récupère la configuration courrante de l'hôte.
+        Tâche récupérant la configuration courrante de l'hôte.
         """
 
         if self.__config is None or refresh:
             if self.__level < self.__config_level:
-                self.enable(self.__config_level)
+                yield self.enable_task(self.__config_level)
 
-            self.__config = self.run(self.__show_config)[2:]
+            # On ignore la commande et les deux lignes d'en-tête.
+            self.__config = yield self.run_task(self.__show_config, skip =3)
 
         if clear_comments:
-            return util.text.clear_comments(self.__config, self.__comment_marker)
+            yield reactor.Return(util.text.clear_comments(self.__config,
+                                                          self.__comment_marker))
 
-        return self.__config
+        yield reactor.Return(self.__config)
 
     def get_hostname(self):
         """
@@ -187,7 +283,14 @@ class Cisco(Node):
         Retourne le niveau de privilege actuel.
         """
 
-        ret = self.run(self.__show_privilege)
+        return reactor.call(self.get_privilege_level_task())
+
+    def get_privilege_level_task(self):
+        """
+        Tâche retournant le niveau de privilege actuel.
+        """
+
+        ret = yield self.run_task(self.__show_privilege)
         for line in ret:
             match = re.match('Current privilege level is (\d+)', line)
 
@@ -195,7 +298,7 @@ class Cisco(Node):
                 self.__level = match.group(1)
 
 
-        return self.__level
+        yield reactor.Return(self.__level)
 
 
 
@@ -230,18 +333,19 @@ class OmniSwitch(Node):
 
 
 
-    def get_config(self, refresh =False, clear_comments =False):
+    def get_config_task(self, refresh =False, clear_comments =False):
         """
-        Récupère la configuration courrante de l'hôte.
+        Tâche récupérant la configuration courrante de l'hôte.
         """
 
         if self.__config is None or refresh:
-            self.__config = self.connection.run(self.__show_config)
+            self.__config = yield self.connection.run_task(self.__show_config)
 
         if clear_comments:
-            return util.text.clear_comments(self.__config, self.__comment_marker)
+            yield reactor.Return(util.text.clear_comments(self.__config,
+                                                          self.__comment_marker))
 
-        return self.__config
+        yield reactor.Return(self.__config)
 
     def get_hostname(self):
         """
@@ -269,6 +373,8 @@ class OmniStack(Node):
     __more = '--More--'
     __password = re.compile('Password:\s', re.I)
 
+    __no_paging = 'terminal length 0'
+
     __show_config = 'show running-config'
     __show_privilege = 'show privilege'
 
@@ -301,48 +407,71 @@ class OmniStack(Node):
         Etabli une connection en fonction du mode choisi.
         """
 
-        if Node.connect(self):
-            self.__level = self.get_privilege_level()
-            return True
+        return reactor.call(self.connect_task())
 
-        return False
+    def connect_task(self):
+        """
+        Tâche établissant une connection en fonction du mode choisi.
+        """
+
+        if (yield Node.connect_task(self)):
+            self.__level = yield self.get_privilege_level_task()
+            yield reactor.Return(True)
+
+        yield reactor.Return(False)
 
     def enable(self, level =15, password =None):
         """
         Cette méthode élève les privilèges de l'utilisateur.
         """
 
+        reactor.call(self.enable_task(level, password))
+
+    def enable_task(self, level =15, password =None):
+        """
+        Tâche élevant les privilèges de l'utilisateur.
+        """
+
         enable_password = self.password
         if password is not None:
             enable_password = password
 
-        self.connection.run(self.__enable % {'level': level},
-                            {self.__more: ' ',
-                             self.__password: enable_password})
+        return self.connection.run_task(self.__enable % {'level': level},
+                                        {self.__more: ' ',
+                                         self.__password: enable_password})
 
-    def run(self, command, expected =None):
+    def run_task(self, command, expected =None, skip =1):
         if expected is None:
             expected = {}
         expected[self.__more] = ' '
 
-        return Node.run(self, command, expected)
+        return Node.run_task(self, command, expected, skip)
 
+    def disable_paging_task(self):
+        """
+        Tâche désactivant la pagination des sorties pour la session.
+        """
 
-    def get_config(self, refresh =False, clear_comments =False):
+        return self.run_task(self.__no_paging)
+
+
+    def get_config_task(self, refresh =False, clear_comments =False):
         """
-        Récupère la configuration courrante de l'hôte.
+        Tâche récupérant la configuration courrante de l'hôte.
         """
 
         if self.__config is None or refresh:
             if self.__level < self.__config_level:
-                self.enable(self.__config_level)
+                yield self.enable_task(self.__config_level)
 
-            self.__config = self.run(self.__show_config)[2:]
+            # On ignore la commande et les deux lignes d'en-tête.
+            self.__config = yield self.run_task(self.__show_config, skip =3)
 
         if clear_comments:
-            return util.text.clear_comments(self.__config, self.__comment_marker)
+            yield reactor.Return(util.text.clear_comments(self.__config,
+                                                          self.__comment_marker))
 
-        return self.__config
+        yield reactor.Return(self.__config)
 
     def get_hostname(self):
         """
@@ -361,7 +490,14 @@ class OmniStack(Node):
         Retourne le niveau de privilege actuel.
         """
 
-        ret = self.run(self.__show_privilege)
+        return reactor.call(self.get_privilege_level_task())
+
+    def get_privilege_level_task(self):
+        """
+        Tâche retournant le niveau de privilege actuel.
+        """
+
+        ret = yield self.run_task(self.__show_privilege)
         for line in ret:
             match = re.match('Current privilege level is (\d+)', line)
             invalid_input = re.match('% Invalid input detected.*', line)
@@ -373,7 +509,7 @@ class OmniStack(Node):
                 self.__level = self.__config_level
 
 
-        return self.__level
+        yield reactor.Return(self.__level)
 
 
 
@@ -388,6 +524,8 @@ class SR77xx(Node):
 
     __more = 'Press any key to continue \(Q to quit\)'
 
+    __no_paging = 'environment no more'
+
     __show_config  = 'admin display-config'
     __show_chassis = 'show chassis'
 
@@ -400,6 +538,7 @@ class SR77xx(Node):
         """
 
         self.__config = None
+        self.__hostname = None
 
         if prompt is not None:
             Node.__init__(self, mode, hostname, username, password, prompt,
@@ -410,36 +549,57 @@ class SR77xx(Node):
 
 
 
-    def run(self, command, expected =None):
+    def run_task(self, command, expected =None, skip =1):
         if expected is None:
             expected = {}
         expected[self.__more] = ' '
 
-        return Node.run(self, command, expected)
+        return Node.run_task(self, command, expected, skip)
+
+    def disable_paging_task(self):
+        """
+        Tâche désactivant la pagination des sorties pour la session.
+        """
+
+        return self.run_task(self.__no_paging)
 
 
-    def get_config(self, refresh =False, clear_comments =False):
+    def get_config_task(self, refresh =False, clear_comments =False):
         """
-        Récupère la configuration courrante de l'hôte.
+        Tâche récupérant la configuration courrante de l'hôte.
         """
 
         if self.__config is None or refresh:
-            self.__config = self.connection.run(self.__show_config)
+            self.__config = yield self.connection.run_task(self.__show_config)
 
         if clear_comments:
-            return util.text.clear_comments(self.__config, self.__comment_marker)
+            yield reactor.Return(util.text.clear_comments(self.__config,
+                                                          self.__comment_marker))
 
-        return self.__config
+        yield reactor.Return(self.__config)
 
     def get_hostname(self):
         """
         Retourne le nom d'hôte du système.
         """
 
-        chassis = self.run(self.__show_chassis)
+        if self.__hostname is not None:
+            return self.__hostname
+
+        return reactor.call(self.get_hostname_task())
+
+    def get_hostname_task(self):
+        """
+        Tâche retournant le nom d'hôte du système.
+        """
+
+        chassis = yield self.run_task(self.__show_chassis)
 
         for line in chassis:
             match = re.match('\s+Name\s+:\s+(.*)', line)
 
             if match:
-                return match.group(1).lower()
+                self.__hostname = match.group(1).lower()
+                break
+
+        yield reactor.Return(self.__hostname)
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+#
+# Package: net.reactor
+#
+try:
+    import sys
+    import time
+    import types
+    import select
+except ImportError, e:
+    raise ImportError(str(e) +
+"""
+    A critical module could not be imported.
+""")
+
+
+__all__ = ['Timeout', 'Wait', 'Return', 'Task', 'Reactor', 'call']
+
+
+
+class Timeout(Exception):
+    """
+    Exception levée dans une tâche lorsque son attente a expiré.
+    """
+
+
+
+
+class Wait(object):
+    """
+    Elément renvoyé par une tâche pour attendre que le descripteur de fichier
+    soit lisible.
+    """
+
+    def __init__(self, fd, timeout =None):
+        """
+        Constructeur de la classe Wait.
+
+        @param fd:
+            Descripteur de fichier à surveiller.
+
+        @param timeout:
+            Temps d'attente maximum en secondes, None pour attendre
+            indéfiniment.
+        """
+
+        self.fd = fd
+        self.timeout = timeout
+
+
+
+
+class Return(object):
+    """
+    Elément renvoyé par une tâche pour terminer et transmettre son résultat.
+
+    Python 2 n'autorise pas 'return valeur' dans un générateur.
+    """
+
+    def __init__(self, value =None):
+        """
+        Constructeur de la classe Return.
+        """
+
+        self.value = value
+
+
+
+
+class Task(object):
+    """
+    Tâche exécutée par le réacteur.
+
+    Une tâche est un générateur qui peut renvoyer :
+     - un objet Wait, la tâche est suspendue jusqu'à ce que le descripteur
+       soit lisible ;
+     - un générateur, celui-ci est exécuté comme sous-tâche et son résultat
+       est renvoyé à la tâche appelante ;
+     - un objet Return, la tâche se termine avec la valeur donnée.
+    """
+
+    def __init__(self, generator, callback =None):
+        """
+        Constructeur de la classe Task.
+        """
+
+        self.stack    = [generator]
+        self.callback = callback
+
+        self.done   = False
+        self.result = None
+        self.error  = None
+
+        self.deadline = None
+
+
+
+    def get_result(self):
+        """
+        Retourne le résultat de la tâche ou lève l'exception qui l'a
+        terminée.
+        """
+
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+
+        return self.result
+
+
+
+
+class Reactor(object):
+    """
+    Boucle d'évènements mono-thread.
+
+    Le réacteur exécute de nombreuses tâches en même temps et attend les
+    données de toutes les sessions avec un seul appel à poll().
+    """
+
+    def __init__(self):
+        """
+        Constructeur de la classe Reactor.
+        """
+
+        self.__poller  = select.poll()
+        self.__ready   = list()
+        self.__waiting = dict()
+
+
+
+    def add(self, generator, callback =None):
+        """
+        Ajoute une tâche au réacteur. Elle sera exécutée par run().
+
+        @param generator:
+            Générateur de la tâche.
+
+        @param callback:
+            Fonction appelée avec la tâche lorsque celle-ci est terminée.
+        """
+
+        task = Task(generator, callback)
+        self.__ready.append(task)
+
+        return task
+
+    def pending(self):
+        """
+        Retourne le nombre de tâches non terminées.
+        """
+
+        return len(self.__ready) + len(self.__waiting)
+
+    def run(self):
+        """
+        Exécute les tâches jusqu'à ce qu'elles soient toutes terminées.
+        """
+
+        while self.pending():
+            self.run_once()
+
+    def run_once(self):
+        """
+        Démarre les nouvelles tâches puis attend les prochaines données ou
+        la prochaine échéance une seule fois.
+        """
+
+        # On démarre les nouvelles tâches.
+        while self.__ready:
+            self.__step(self.__ready.pop(0))
+
+        if not self.__waiting:
+            return
+
+        # On attend jusqu'à la prochaine échéance.
+        timeout = None
+        deadlines = [task.deadline for task in self.__waiting.values() \
+                     if task.deadline is not None]
+        if deadlines:
+            timeout = max(0, int((min(deadlines) - time.time()) * 1000))
+
+        events = list()
+        try:
+            events = self.__poller.poll(timeout)
+        except select.error, e:
+            # Appel interrompu par un signal, on recommence.
+            if e[0] != 4:
+                raise
+
+        for fd, event in events:
+            task = self.__release(fd)
+            if task is not None:
+                self.__step(task)
+
+        # Les tâches dont l'attente a expiré reçoivent l'exception Timeout.
+        now = time.time()
+        for fd, task in self.__waiting.items():
+            if task.deadline is not None and task.deadline <= now:
+                self.__release(fd)
+                self.__step(task, error =(Timeout,
+                                          Timeout('Timeout exceeded.'),
+                                          None))
+
+
+    def __release(self, fd):
+        """
+        Retire le descripteur de fichier de la liste d'attente et retourne
+        la tâche associée.
+        """
+
+        task = self.__waiting.pop(fd, None)
+        if task is not None:
+            self.__poller.unregister(fd)
+            task.deadline = None
+
+        return task
+
+    def __step(self, task, value =None, error =None):
+        """
+        Fait avancer la tâche jusqu'à sa prochaine attente ou sa fin.
+        """
+
+        while task.stack:
+            generator = task.stack[-1]
+
+            try:
+                if error is not None:
+                    item = generator.throw(*error)
+                    error = None
+                else:
+                    item = generator.send(value)
+            except StopIteration:
+                # La (sous-)tâche s'est terminée sans résultat.
+                task.stack.pop()
+                value = None
+                continue
+            except Exception:
+                # L'exception est transmise à la tâche appelante.
+                task.stack.pop()
+                error = sys.exc_info()
+                value = None
+                continue
+
+            value = None
+            if isinstance(item, Return):
+                task.stack.pop()
+                generator.close()
+                value = item.value
+            elif isinstance(item, types.GeneratorType):
+                task.stack.append(item)
+            elif isinstance(item, Wait):
+                if item.timeout is not None:
+                    task.deadline = time.time() + item.timeout
+                self.__waiting[item.fd] = task
+                self.__poller.register(item.fd, select.POLLIN | select.POLLPRI)
+                return
+            else:
+                error = (TypeError,
+                         TypeError("Invalid task item: %(i)r." % {'i': item}),
+                         None)
+
+        task.done   = True
+        task.result = value
+        task.error  = error
+
+        if task.callback is not None:
+            task.callback(task)
+
+
+
+
+def call(generator):
+    """
+    Exécute la tâche jusqu'à sa fin et retourne son résultat.
+
+    Cette fonction permet d'utiliser une tâche de manière bloquante.
+    """
+
+    reactor = Reactor()
+    task = reactor.add(generator)
+    reactor.run()
+
+    return task.get_result()
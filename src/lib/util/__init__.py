@@ -3,4 +3,4 @@
 # Package: util
 #
 
-__all__ = ['config', 'date', 'text']
\ No newline at end of file
+__all__ = ['config', 'date', 'inventory', 'lazy', 'text']
\ No newline at end of file
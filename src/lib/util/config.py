@@ -4,14 +4,26 @@
 #
 try:
     import re
+    import os
+    import stat
+    import marshal
+    import hashlib
+    import tempfile
+    import itertools
+    import cStringIO
 
-    from ConfigParser import ConfigParser, NoOptionError
+    import lazy
+
+    from ConfigParser import ConfigParser
 except ImportError, e:
     raise ImportError(str(e) +
 """
     A critical module could not be imported.
 """)
 
+# Le module n'est importé que si un inventaire est utilisé.
+inventory = lazy.Module('util.inventory')
+
 
 __all__ = ['ConfigError', 'Config']
 
@@ -42,6 +54,10 @@ class Config(ConfigParser):
                                 ('password', 'string', False),
                                 ('prompt', 'string', False),
                                 ('timeout', 'int', False),
+                                ('multiplex', 'bool', False),
+                                ('control_persist', 'int', False),
+                                ('interval', 'int', False),
+                                ('priority', 'int', False),
                                )
     __nodes_spec_sub_options = (
                                 ('hostname', 'string', True),
@@ -89,7 +105,24 @@ class Config(ConfigParser):
                                        ('root_directory', 'string', True),
                                        ('file_pattern', 'string', True),
                                        ('rotation', 'int', False),
+                                       ('keep_daily', 'int', False),
+                                       ('keep_weekly', 'int', False),
+                                       ('keep_monthly', 'int', False),
+                                       ('max_age', 'int', False),
                                        ('write_diff', 'bool', False),
+                                       ('diff_hints', 'bool', False),
+                                       ('backend', 'string', False),
+                                       ('database', 'string', False),
+                                       ('storage', 'string', False),
+                                       ('compression', 'string', False),
+                                       ('checkpoint', 'int', False),
+                                       ('commit_batch', 'int', False),
+                                       ('workers', 'int', False),
+                                       ('engine', 'string', False),
+                                       ('processes', 'int', False),
+                                       ('control_directory', 'string', False),
+                                       ('durations_file', 'string', False),
+                                       ('inventory', 'string', False),
                                       ),
                                      ),
                        'contact':    (
@@ -100,12 +133,21 @@ class Config(ConfigParser):
                                        ('sender', 'string', False),
                                        ('send_backup', 'bool', False),
                                        ('send_diff', 'bool', False),
+                                       ('mail_messages', 'int', False),
                                       ),
                                       # Liste des options pour les sous-sections.
                                       (
                                        ('e-mail', 'string', True),
                                       ),
                                      ),
+                       'daemon':     (
+                                      False,
+                                      False,
+                                      (
+                                       ('sessions', 'int', False),
+                                       ('idle', 'int', False),
+                                      ),
+                                     ),
                        'logger':     (
                                       False,
                                       False,
@@ -144,30 +186,248 @@ class Config(ConfigParser):
     # Séparateur utilisé pour les sous-sections.
     __subsection_sep = '::'
 
+    # Schéma d'un nom de sous-section :
+    # section-parente(séparateur)sous-section
+    __subsection_re = re.compile('^[-\w]+%(separator)s[-\w]+$' % \
+                                 {'separator': __subsection_sep})
 
+    # Plage de valeurs d'une adresse de modèle : {début..fin}.
+    __range_re = re.compile('\{(\d+)\.\.(\d+)\}')
 
-    def __init__(self, config_file):
+    # Index de la spécification, construit une seule fois : pour chaque
+    # section, le dictionnaire des types de ses options et celui des types
+    # des options de ses sous-sections.
+    __spec_index = None
+
+    # Fonctions de lecture de chaque type d'option.
+    __getters = {'string': ConfigParser.get,
+                 'int':    ConfigParser.getint,
+                 'bool':   ConfigParser.getboolean}
+
+    # Version du format des instantanés, à changer avec leur contenu.
+    __snapshot_version = 2
+
+
+
+    def __init__(self, config_file, snapshot =True):
         """
         Constructeur de la classe Config.
+
+        @param snapshot:
+            Si vrai, la configuration validée est enregistrée dans un
+            instantané (voir get_snapshot_file) qui est relu directement aux
+            démarrages suivants, tant que le fichier ne change pas.
         """
 
         ConfigParser.__init__(self)
 
-        # On vérifie la validité du fichier.
-        read_ok = self.read(config_file)
-
+        # Caches des noms de sections découpés, des options présentes dans
+        # chaque section (héritées comprises) et des valeurs déjà lues et
+        # converties, par section.
+        self.__names   = dict()
+        self.__options = dict()
+        self.__values  = dict()
+
+        # Noeuds de l'inventaire déjà lus (section -> options), dans l'ordre
+        # de lecture, et suite de l'inventaire : None tant qu'il n'est pas
+        # ouvert, False une fois lu en entier.
+        self.__inventory          = dict()
+        self.__inventory_sections = list()
+        self.__inventory_reader   = None
+
+        # Index des sous-sections du fichier par section parente et des
+        # sections des noeuds par groupe, construits à la première
+        # utilisation.
+        self.__subsection_index = None
+        self.__group_index      = None
+
+        # Modèles de noeuds par section parente, voir __get_template_index.
+        self.__template_index = None
+
+        # Répertoire du fichier, base des chemins relatifs de l'inventaire.
+        self.__directory = os.path.dirname(os.path.abspath(config_file))
+
+        # Le fichier n'est lu qu'une fois : son contenu sert à la fois à
+        # l'analyse et à la clé de l'instantané.
         # Si le fichier n'a pas pu être lu, on quitte.
-        parse_ok = False
-        for config in read_ok:
-            if config == config_file:
-                parse_ok = True
-        if not parse_ok:
+        try:
+            f = open(config_file, 'r')
+            try:
+                data  = f.read()
+                mtime = os.fstat(f.fileno()).st_mtime
+            finally:
+                f.close()
+        except IOError:
             raise ConfigError("Could not read file: %(file)s." % \
-                              {'file': config_file}) 
+                              {'file': config_file})
+
+        key = self.__get_snapshot_key(config_file, mtime, data)
+        if snapshot and self.__load_snapshot(config_file, key):
+            return
+
+        # On vérifie la validité du fichier.
+        self._read(cStringIO.StringIO(data), config_file)
 
         # On vérifie ensuite que le fichier correspond à la spécification.
         self.__check()
 
+        if snapshot:
+            self.__save_snapshot(config_file, key)
+
+
+    @staticmethod
+    def get_snapshot_file(config_file):
+        """
+        Retourne le chemin de l'instantané du fichier de configuration, un
+        fichier caché dans le même répertoire.
+        """
+
+        directory, filename = os.path.split(os.path.abspath(config_file))
+
+        return os.path.join(directory, '.' + filename + '.snapshot')
+
+    @classmethod
+    def __get_snapshot_key(cls, config_file, mtime, data):
+        """
+        Retourne la clé identifiant le fichier de configuration : son chemin,
+        sa date de modification et l'empreinte de son contenu. La
+        spécification en fait partie, un fichier validé par une autre version
+        doit être vérifié à nouveau.
+        """
+
+        return (cls.__snapshot_version,
+                os.path.abspath(config_file),
+                mtime,
+                hashlib.sha256(data).hexdigest(),
+                hashlib.sha256(repr(sorted(cls.__spec_sections.items()))) \
+                       .hexdigest())
+
+    def __load_snapshot(self, config_file, key):
+        """
+        Charge l'instantané du fichier de configuration s'il correspond à la
+        clé. Retourne vrai en cas de succès.
+
+        L'instantané n'est relu que s'il appartient à l'utilisateur courant
+        et que lui seul peut le modifier : un autre utilisateur pouvant écrire
+        dans le répertoire ne doit pas pouvoir changer la configuration.
+        """
+
+        try:
+            f = open(self.get_snapshot_file(config_file), 'rb')
+            try:
+                info = os.fstat(f.fileno())
+                if info.st_uid != os.getuid() or \
+                   info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+                    return False
+
+                snapshot = marshal.load(f)
+            finally:
+                f.close()
+        except Exception:
+            # Un instantané absent ou illisible est ignoré, il sera remplacé.
+            return False
+
+        if not isinstance(snapshot, tuple) or len(snapshot) != 3 or \
+           snapshot[0] != key:
+            return False
+
+        self._defaults = self._dict(snapshot[1])
+        self._sections = self._dict(snapshot[2])
+
+        return True
+
+    def __save_snapshot(self, config_file, key):
+        """
+        Enregistre l'instantané du fichier de configuration validé.
+
+        L'instantané est écrit avec marshal, qui ne relit que des types de
+        base et n'exécute donc aucun code au chargement. Il contient les mots de passe : il n'est lisible que par
+        son propriétaire. Il est remplacé d'un coup, il n'est donc jamais lu
+        à moitié écrit. S'il ne peut pas être écrit, par exemple dans un
+        répertoire en lecture seule, il est ignoré.
+        """
+
+        path = self.get_snapshot_file(config_file)
+
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix ='.snapshot',
+                                            dir =os.path.dirname(path))
+        except OSError:
+            return
+
+        try:
+            f = os.fdopen(fd, 'wb')
+            try:
+                # L'ordre des sections est conservé, pas celui des options
+                # d'une section : des dictionnaires simples sont bien plus
+                # rapides à relire.
+                marshal.dump((key,
+                              self._defaults.items(),
+                              [(section, dict(options)) for section, options \
+                               in self._sections.iteritems()]),
+                             f)
+            finally:
+                f.close()
+            os.rename(tmp_path, path)
+        except (IOError, OSError):
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+
+    @classmethod
+    def __get_spec_index(cls):
+        """
+        Retourne l'index de la spécification, voir __spec_index.
+        """
+
+        if cls.__spec_index is None:
+            index = dict()
+            for section, spec in cls.__spec_sections.iteritems():
+                sub_options = dict()
+                if spec[1]:
+                    sub_options = dict([item[:2] for item in spec[3]])
+
+                index[section] = (dict([item[:2] for item in spec[2]]),
+                                  sub_options)
+            cls.__spec_index = index
+
+        return cls.__spec_index
+
+    def __clear_cache(self):
+        """
+        Vide les caches des options et des valeurs, lorsque le fichier est
+        relu ou modifié.
+        """
+
+        self.__options.clear()
+        self.__values.clear()
+
+        self.__inventory          = dict()
+        self.__inventory_sections = list()
+        self.__inventory_reader   = None
+
+        self.__subsection_index = None
+        self.__group_index      = None
+        self.__template_index   = None
+
+    def _read(self, fp, fpname):
+        self.__clear_cache()
+        return ConfigParser._read(self, fp, fpname)
+
+    def set(self, section, option, value =None):
+        self.__clear_cache()
+        return ConfigParser.set(self, section, option, value)
+
+    def remove_option(self, section, option):
+        self.__clear_cache()
+        return ConfigParser.remove_option(self, section, option)
+
+    def remove_section(self, section):
+        self.__clear_cache()
+        return ConfigParser.remove_section(self, section)
+
 
     def __check(self):
         """
@@ -247,19 +507,13 @@ class Config(ConfigParser):
         passée en paramètre.
         """
 
-        parent_section = self.get_parent_section_name(section)
-
-
-        if self.is_subsection(section):
-            for item in self.__spec_sections.get(parent_section)[3]:
-                if item[0] == option:
-                    return True
+        options, sub_options = \
+            self.__get_spec_index()[self.get_parent_section_name(section)]
 
-        for item in self.__spec_sections.get(parent_section)[2]:
-            if item[0] == option:
-                return True
+        if self.is_subsection(section) and option in sub_options:
+            return True
 
-        return False
+        return option in options
 
 
     def __get_spec_mandatory_sections(self):
@@ -297,26 +551,280 @@ class Config(ConfigParser):
         return mandatory
 
 
+    def get_inventory_file(self):
+        """
+        Retourne le chemin du fichier d'inventaire, ou None s'il n'y en a
+        pas. Un chemin relatif part du répertoire du fichier de
+        configuration, quel que soit le répertoire courant.
+        """
+
+        if not ConfigParser.has_option(self, 'general', 'inventory'):
+            return None
+
+        return os.path.join(self.__directory,
+                            os.path.expanduser(ConfigParser.get(self,
+                                                                'general',
+                                                                'inventory')))
+
+    def __read_inventory(self):
+        """
+        Lit le noeud suivant de l'inventaire, le vérifie et l'enregistre.
+        Retourne le nom de sa section, ou None à la fin de l'inventaire.
+        """
+
+        if self.__inventory_reader is False:
+            return None
+
+        if self.__inventory_reader is None:
+            # L'option est lue directement, get_value peut chercher une
+            # section dans l'inventaire.
+            if not ConfigParser.has_option(self, 'general', 'inventory'):
+                self.__inventory_reader = False
+                return None
+
+            self.__inventory_reader = iter(inventory.Inventory(
+                self.get_inventory_file()))
+
+        for node_type, name, options in self.__inventory_reader:
+            section = node_type + self.__subsection_sep + name
+            self.__check_inventory_node(section, options)
+
+            self.__inventory[section] = options
+            self.__inventory_sections.append(section)
+
+            return section
+
+        self.__inventory_reader = False
+        return None
+
+    def __check_inventory_node(self, section, options):
+        """
+        Vérifie la validité d'un noeud de l'inventaire, comme celle d'une
+        sous-section du fichier.
+        """
+
+        if self.get_parent_section_name(section) \
+           not in self.__nodes_section_name:
+            raise ConfigError("Inventory, node '%(section)s': invalid node type." % \
+                              {'section': section})
+
+        if not self.is_subsection(section):
+            raise ConfigError("Inventory, node '%(section)s': invalid node name." % \
+                              {'section': section})
+
+        if section in self._sections or section in self.__inventory or \
+           self.__get_template_node(section) is not None:
+            raise ConfigError("Inventory, node '%(section)s' is defined twice." % \
+                              {'section': section})
+
+        parent_section = self.get_parent_section_name(section)
+        for option in self.__get_spec_mandatory_options(section):
+            if option[0] not in options and \
+               not ConfigParser.has_option(self, parent_section, option[0]):
+                raise ConfigError("Inventory, node '%(section)s', the option '%(option)s' is mandatory." % \
+                                  {'section': section, 'option': option[0]})
+
+        for option in options:
+            if not self.__spec_has_option(section, option):
+                raise ConfigError("Inventory, node '%(section)s', invalid option: '%(option)s'." % \
+                                  {'section': section, 'option': option})
+
+    def __get_inventory_node(self, section):
+        """
+        Retourne les options du noeud de l'inventaire correspondant à la
+        section, ou None si ce n'est pas un noeud de l'inventaire.
+        L'inventaire n'est lu que jusqu'à ce noeud.
+        """
+
+        if section in self._sections or \
+           self.get_parent_section_name(section) \
+           not in self.__nodes_section_name:
+            return None
+
+        while section not in self.__inventory:
+            if self.__read_inventory() is None:
+                return None
+
+        return self.__inventory[section]
+
+    def iter_inventory(self):
+        """
+        Parcourt les sections des noeuds de l'inventaire, au fur et à mesure
+        de sa lecture.
+
+        Les noeuds de l'inventaire sont des sous-sections de leur type : ils
+        en héritent les options, comme les sous-sections du fichier.
+        """
+
+        n = 0
+        while True:
+            if n < len(self.__inventory_sections):
+                yield self.__inventory_sections[n]
+                n += 1
+            elif self.__read_inventory() is None:
+                return
+
+
+    def __get_template_index(self):
+        """
+        Retourne les modèles de noeuds par section parente.
+
+        Un modèle est une sous-section de noeud dont l'adresse contient des
+        plages de valeurs, par exemple 'hostname = 10.1.{1..254}.2'. Il
+        représente un noeud par combinaison de valeurs, nommé d'après la
+        sous-section suivie des valeurs : 'Cisco::access-1', ... Chaque modèle
+        est un tuple (section, nom, textes, plages), où les plages sont des
+        tuples (début, fin, largeur) et les textes ceux qui les entourent.
+        """
+
+        if self.__template_index is None:
+            index = dict()
+            for parent_section in self.__nodes_section_name:
+                for section in self.get_subsection_list(parent_section):
+                    if not ConfigParser.has_option(self, section, 'hostname'):
+                        continue
+
+                    parts = self.__range_re.split(
+                        ConfigParser.get(self, section, 'hostname'))
+                    if len(parts) == 1:
+                        continue
+
+                    ranges = list()
+                    for n in xrange(1, len(parts), 3):
+                        start, end = parts[n], parts[n + 1]
+                        if int(start) > int(end):
+                            raise ConfigError("Section '%(section)s', invalid range: {%(start)s..%(end)s}." % \
+                                              {'section': section,
+                                               'start': start, 'end': end})
+
+                        # Les valeurs sont complétées par des zéros comme
+                        # le début de la plage : {01..48}.
+                        width = 0
+                        if len(start) > 1 and start[0] == '0':
+                            width = len(start)
+
+                        ranges.append((int(start), int(end), width))
+
+                    index.setdefault(parent_section, list()).append(
+                        (section, self.get_subsection_name(section),
+                         parts[::3], ranges))
+
+            self.__template_index = index
+
+        return self.__template_index
+
+    def __iter_template(self, template):
+        """
+        Parcourt les sections des noeuds d'un modèle, sans les enregistrer.
+        """
+
+        section, name, texts, ranges = template
+        parent_section = self.get_parent_section_name(section)
+
+        for values in itertools.product(*[xrange(start, end + 1) \
+                                          for start, end, width in ranges]):
+            node_section = parent_section + self.__subsection_sep + name \
+                           + '-' + '-'.join(['%0*i' % (ranges[n][2], value) \
+                                             for n, value \
+                                             in enumerate(values)])
+
+            # Le nom du noeud doit désigner ce modèle et lui seul.
+            node = self.__get_template_node(node_section)
+            if node_section in self._sections or node is None or \
+               node[1] != section:
+                raise ConfigError("Section '%(section)s', the node '%(node)s' is defined twice." % \
+                                  {'section': section, 'node': node_section})
+
+            yield node_section
+
+    def __get_template_node(self, section):
+        """
+        Retourne le tuple (options, section du modèle) du noeud d'un modèle
+        correspondant à la section, ou None si ce n'en est pas un. Les
+        options du noeud se limitent à son adresse, le reste est hérité du
+        modèle.
+        """
+
+        names = self.__split(section)
+        if len(names) != 2:
+            return None
+
+        for template, name, texts, ranges \
+            in self.__get_template_index().get(names[0], ()):
+            if not names[1].startswith(name + '-'):
+                continue
+
+            values = names[1][len(name) + 1:].split('-')
+            if len(values) != len(ranges):
+                continue
+
+            hostname = [texts[0]]
+            for n in xrange(len(ranges)):
+                start, end, width = ranges[n]
+                if not values[n].isdigit() or \
+                   not start <= int(values[n]) <= end or \
+                   '%0*i' % (width, int(values[n])) != values[n]:
+                    break
+
+                hostname.extend([values[n], texts[n + 1]])
+            else:
+                return ({'hostname': ''.join(hostname)}, template)
+
+        return None
+
+    def __get_node(self, section):
+        """
+        Retourne les options propres d'une section et la section dont elle
+        hérite avant sa section parente, sous la forme d'un tuple (options,
+        section) :
+         - (None, section) pour une section du fichier ;
+         - (options, section du modèle) pour un noeud d'un modèle ;
+         - (options, None) pour un noeud de l'inventaire.
+        """
+
+        if section in self._sections:
+            return (None, section)
+
+        node = self.__get_template_node(section)
+        if node is not None:
+            return node
+
+        node = self.__get_inventory_node(section)
+        if node is not None:
+            return (node, None)
+
+        return (None, section)
+
+
     def has_option(self, section, option):
         """
         Renvoi si la section possède l'option passée en paramètre.
         """
 
-        # On travaille sur le nom de la section parente
-        # ou cas où s'il s'agit d'une sous-section.
-        parent_section = self.get_parent_section_name(section)
+        options = self.__options.get(section)
+        if options is None:
+            # On travaille sur le nom de la section parente
+            # ou cas où s'il s'agit d'une sous-section.
+            parent_section = self.get_parent_section_name(section)
 
+            if not self.__spec_sections.has_key(parent_section):
+                raise NameError("Invalid section name: '%(section)s'." % \
+                                {'section': section})
 
-        if self.__spec_sections.has_key(parent_section):
-            if ConfigParser.has_option(self, section, option):
-                return True
-            if ConfigParser.has_option(self, parent_section, option):
-                return True
+            # Options de la section et de sa section parente.
+            node, base_section = self.__get_node(section)
 
-            return False
-        else:
-            raise NameError("Invalid section name: '%(section)s'." % \
-                            {'section': section})
+            options = set(self._defaults)
+            for name in (base_section, parent_section):
+                if name in self._sections:
+                    options.update(self._sections[name])
+
+            if node is not None:
+                options.update(node)
+
+            self.__options[section] = options
+
+        return self.optionxform(option) in options
 
 
     def is_subsection(self, section):
@@ -324,57 +832,128 @@ class Config(ConfigParser):
         Permet de déterminer si la section est en fait une sous-section.
         """
 
-        # Le schéma recherché est le suivant :
-        # section-parente(séparateur)sous-section
-        if re.search('^[-\w]+%(separator)s[-\w]+$' % {'separator': self.__subsection_sep},
-                     section):
-            return True
-        else:
-            return False
+        return self.__subsection_re.search(section) is not None
+
+
+    def __get_subsection_index(self):
+        """
+        Retourne l'index des sous-sections du fichier par section parente,
+        construit en un seul parcours des sections.
+        """
+
+        if self.__subsection_index is None:
+            index = dict()
+            for section in self._sections:
+                names = self.__split(section)
+                if len(names) > 1:
+                    index.setdefault(names[0], list()).append(section)
+
+            self.__subsection_index = dict([(parent, tuple(sections)) \
+                                            for parent, sections \
+                                            in index.iteritems()])
+
+        return self.__subsection_index
 
+    def get_subsection_list(self, parent_section):
+        """
+        Retourne la liste des sous-sections du fichier de la section parente.
+        """
+
+        return self.__get_subsection_index().get(parent_section, ())
 
     def get_subsections(self, parent_section):
 
         if self.__spec_has_subsection(parent_section):
-            sections = dict()
-            for f_sec in self._sections:
-                match = re.match('(%(section)s)%(separator)s(.*)$' % \
-                                 {'section': parent_section,
-                                  'separator': self.__subsection_sep},
-                                 f_sec)
-                if match:
-                    if not sections.has_key(match.group(1)):
-                        sections[match.group(1)] = list()
-
-                    sections[match.group(1)].append(f_sec)
-            return sections
+            sections = self.get_subsection_list(parent_section)
+            if sections:
+                return {parent_section: list(sections)}
+            return dict()
 
         return None
 
+    def get_group_sections(self, group):
+        """
+        Retourne la liste des sections des noeuds du groupe, ceux de
+        l'inventaire compris.
+        """
+
+        if self.__group_index is None:
+            index = dict()
+            for section in self.iter_nodes_section():
+                if self.has_option(section, 'group'):
+                    index.setdefault(self.get_value(section, 'group'),
+                                     list()).append(section)
+
+            self.__group_index = dict([(name, tuple(sections)) \
+                                       for name, sections \
+                                       in index.iteritems()])
+
+        return self.__group_index.get(group, ())
+
     def get_nodes_section(self):
         """
-        Retourne la liste des noeuds de la configuration.
+        Retourne la liste des noeuds de la configuration, par type.
         """
         
         sections = dict()
-        for node_section in self.__nodes_section_name:
-            sections.update(self.get_subsections(node_section))
+        for section in self.iter_nodes_section():
+            sections.setdefault(self.get_parent_section_name(section),
+                                list()).append(section)
 
         return sections
 
+    def iter_nodes_section(self):
+        """
+        Parcourt les sections des noeuds de la configuration : les
+        sous-sections du fichier, dont les noeuds des modèles générés au fur
+        et à mesure, puis les noeuds de l'inventaire au fur et à mesure de sa
+        lecture.
+        """
+
+        # Les modèles sont remplacés par leurs noeuds.
+        templates = dict()
+        for parent_section, items in self.__get_template_index().iteritems():
+            for template in items:
+                templates[template[0]] = template
+
+        index = self.__get_subsection_index()
+        for node_section in self.__nodes_section_name:
+            for section in index.get(node_section, ()):
+                if section in templates:
+                    for template_section in \
+                        self.__iter_template(templates[section]):
+                        yield template_section
+                else:
+                    yield section
+
+        for section in self.iter_inventory():
+            yield section
+
+    def __split(self, section):
+        """
+        Retourne les éléments du nom de la section, découpé une seule fois.
+        """
+
+        names = self.__names.get(section)
+        if names is None:
+            names = self.__names[section] = \
+                section.split(self.__subsection_sep)
+
+        return names
+
     def get_parent_section_name(self, section):
         """
         Retourne le nom de la section parente.
         """
 
-        return re.split(self.__subsection_sep, section)[0]
+        return self.__split(section)[0]
 
     def get_subsection_name(self, section):
         """
         Retourne le nom de la sous-section.
         """
 
-        return re.split(self.__subsection_sep, section)[1]
+        return self.__split(section)[1]
 
     def get_value(self, section, option):
         """
@@ -382,61 +961,67 @@ class Config(ConfigParser):
         paramètre.
         """
 
+        # La valeur a déjà été lue et convertie.
+        values = self.__values.get(section)
+        if values is not None and option in values:
+            return values[option]
+
         # On travaille sur le nom de la section parente
         # au cas où s'il s'agit d'une sous-section.
         parent_section = self.get_parent_section_name(section)
 
-
         # On vérifie d'abord que la section existe.
-        if self.__spec_sections.has_key(parent_section):
-            # Puis on récupère la spécification de la section.
-            section_spec = self.__spec_sections.get(parent_section)
-            option_type  = None
-
-            # On parcours les options de la spécification à la recherche
-            # du type de la valeur de l'option que l'on souhaite obtenir.
-            for option_spec in section_spec[2]:
-                if option_spec[0] == option:
-                    option_type = option_spec[1]
-
-            # Introuvable dans les options de la section ?
-            # On regarde dans ceux de la sous-section si elle existe.
-            if self.__spec_has_subsection(parent_section):
-                for sub_option_spec in section_spec[3]:
-                    if sub_option_spec[0] == option:
-                        option_type = sub_option_spec[1]
-
-
-            # On appelle la fonction qui va bien en fonction du type à obtenir.
-            #
-            # Les sous-sections héritent des options de leur section parente.
-            # Si l'option n'existe pas dans la section, il doit sûrement s'agir
-            # d'une sous-section. On cherche alors l'option dans la section
-            # parente.
-            if option_type == 'string':
-                try:
-                    return ConfigParser.get(self, section, option)
-                except NoOptionError:
-                    return ConfigParser.get(self, parent_section, option)
-
-            if option_type == 'int':
-                try:
-                    return ConfigParser.getint(self, section, option)
-                except NoOptionError:
-                    return ConfigParser.getint(self, parent_section, option)
-
-            if option_type == 'bool':
-                try:
-                    return ConfigParser.getboolean(self, section, option)
-                except NoOptionError:
-                    return ConfigParser.getboolean(self, parent_section, option)
-
-
-            return None
-        else:
+        if not self.__spec_sections.has_key(parent_section):
             raise NameError("Invalid section name: '%(section)s'." % \
                             {'section': section})
 
+        # Puis on récupère le type de l'option dans la spécification de la
+        # section, ou dans celle de ses sous-sections.
+        options, sub_options = self.__get_spec_index()[parent_section]
+        option_type = sub_options.get(option, options.get(option))
+
+        value = None
+        if option_type is not None:
+            node, base_section = self.__get_node(section)
+
+            if node is not None and option in node:
+                value = self.__convert(option_type, node[option])
+            else:
+                # Les sous-sections héritent des options de leur section
+                # parente. Si l'option n'existe pas dans la section, on la lit
+                # dans la section parente.
+                source = parent_section
+                if base_section is not None and \
+                   (not self.has_section(base_section) or \
+                    ConfigParser.has_option(self, base_section, option)):
+                    source = base_section
+
+                value = self.__getters[option_type](self, source, option)
+
+        if values is None:
+            values = self.__values[section] = dict()
+        values[option] = value
+
+        return value
+
+
+    def __convert(self, option_type, value):
+        """
+        Convertit la valeur d'une option d'un noeud de l'inventaire ou d'un
+        modèle selon son type, comme le fait ConfigParser.
+        """
+
+        if option_type == 'int':
+            return int(value)
+
+        if option_type == 'bool':
+            if value.lower() not in self._boolean_states:
+                raise ValueError('Not a boolean: %(value)s' % \
+                                 {'value': value})
+            return self._boolean_states[value.lower()]
+
+        return value
+
 
     @classmethod
     def print_spec(cls):
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+#
+# Package: util.inventory
+#
+try:
+    import re
+    import csv
+    import json
+except ImportError, e:
+    raise ImportError(str(e) +
+"""
+    A critical module could not be imported.
+""")
+
+
+__all__ = ['InventoryError', 'Inventory']
+
+
+
+class InventoryError(Exception):
+    """
+    Classe permettant de gérer les erreurs sur le fichier d'inventaire.
+    """
+
+
+
+
+class Inventory(object):
+    """
+    Cette classe lit les noeuds d'un fichier d'inventaire.
+
+    Chaque noeud est décrit par son type (le nom de la section parente, par
+    exemple 'Cisco'), son adresse ('hostname') et éventuellement un nom, un
+    groupe et toute option d'un noeud redéfinissant celle de la section
+    parente. Sans nom, le noeud prend celui de son adresse, dont les
+    caractères autres que lettres, chiffres, '-' et '_' sont remplacés par
+    '_'.
+
+    Trois formats sont reconnus par l'extension du fichier :
+     - '.csv', une ligne d'en-tête donnant le nom des colonnes puis un noeud
+       par ligne, les cellules vides ne sont pas prises en compte ;
+     - '.json', une liste d'objets ;
+     - '.jsonl', un objet par ligne.
+
+    Les noeuds sont lus au fur et à mesure, sans charger tout le fichier,
+    sauf au format '.json'.
+
+    for node_type, name, options in Inventory('/path/to/nodes.csv'):
+        ...
+    """
+
+    # Colonnes donnant le type et le nom du noeud, les autres sont des
+    # options.
+    type_column = 'type'
+    name_column = 'name'
+
+    # Caractères remplacés dans l'adresse pour former le nom d'un noeud.
+    __name_re = re.compile('[^-\w]')
+
+
+
+    def __init__(self, path):
+        """
+        Constructeur de la classe Inventory.
+
+        @param path:
+            Chemin du fichier d'inventaire.
+
+        @raise InventoryError:
+            Si le format du fichier est inconnu.
+        """
+
+        self.path = path
+
+        self.__reader = None
+        for suffix, reader in (('.csv', self.__iter_csv),
+                               ('.jsonl', self.__iter_jsonl),
+                               ('.json', self.__iter_json)):
+            if path.lower().endswith(suffix):
+                self.__reader = reader
+                break
+
+        if self.__reader is None:
+            raise InventoryError("%(path)s: unknown inventory format." % \
+                                 {'path': path})
+
+
+
+    def __iter__(self):
+        """
+        Parcourt les noeuds de l'inventaire sous la forme de tuples (type,
+        nom, options).
+
+        @raise InventoryError:
+            Si un noeud n'a pas de type ou d'adresse.
+        """
+
+        for location, record in self.__reader():
+            options = dict()
+            for key, value in record.iteritems():
+                # Les valeurs vides ne redéfinissent rien.
+                if key is None or value is None or value == '':
+                    continue
+
+                if isinstance(value, bool):
+                    value = str(value).lower()
+                elif isinstance(value, unicode):
+                    value = value.encode('utf-8')
+                else:
+                    value = str(value)
+
+                options[str(key).strip().lower()] = value
+
+            node_type = options.pop(self.type_column, None)
+            name      = options.pop(self.name_column, None)
+            if node_type is None or 'hostname' not in options:
+                raise InventoryError("%(path)s, %(location)s: the columns '%(type)s' and 'hostname' are mandatory." % \
+                                     {'path': self.path,
+                                      'location': location,
+                                      'type': self.type_column})
+
+            if name is None:
+                name = self.__name_re.sub('_', options['hostname'])
+
+            yield (node_type, name, options)
+
+    def __iter_csv(self):
+        """
+        Parcourt les lignes d'un fichier CSV.
+        """
+
+        f = open(self.path, 'rb')
+        try:
+            reader = csv.DictReader(f)
+            for record in reader:
+                yield ('line %(n)i' % {'n': reader.line_num}, record)
+        finally:
+            f.close()
+
+    def __iter_jsonl(self):
+        """
+        Parcourt les objets d'un fichier JSON contenant un objet par ligne.
+        """
+
+        f = open(self.path, 'r')
+        try:
+            n = 0
+            for line in f:
+                n += 1
+                if not line.strip():
+                    continue
+
+                yield ('line %(n)i' % {'n': n},
+                       self.__check_record(json.loads(line), n))
+        finally:
+            f.close()
+
+    def __iter_json(self):
+        """
+        Parcourt les objets d'un fichier JSON contenant une liste d'objets.
+        """
+
+        f = open(self.path, 'r')
+        try:
+            records = json.load(f)
+        finally:
+            f.close()
+
+        if not isinstance(records, list):
+            raise InventoryError("%(path)s: a list of nodes is expected." % \
+                                 {'path': self.path})
+
+        for n in xrange(len(records)):
+            yield ('node %(n)i' % {'n': n + 1},
+                   self.__check_record(records[n], n + 1))
+
+    def __check_record(self, record, n):
+        """
+        Vérifie qu'un élément d'un fichier JSON est un objet.
+        """
+
+        if not isinstance(record, dict):
+            raise InventoryError("%(path)s, node %(n)i: an object is expected." % \
+                                 {'path': self.path, 'n': n})
+
+        return record
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+#
+# Package: util.lazy
+#
+try:
+    import importlib
+except ImportError, e:
+    raise ImportError(str(e) +
+"""
+    A critical module could not be imported.
+""")
+
+
+__all__ = ['Module']
+
+
+
+class Module(object):
+    """
+    Cette classe représente un module qui n'est importé qu'à sa première
+    utilisation, pour ne pas ralentir le démarrage avec des modules dont la
+    fonctionnalité n'est pas utilisée.
+
+    mail = Module('net.mail')
+    mail.Mail(...)
+    """
+
+    def __init__(self, name):
+        """
+        Constructeur de la classe Module.
+
+        @param name:
+            Nom complet du module, par exemple 'net.mail'.
+        """
+
+        self.__name   = name
+        self.__module = None
+
+
+
+    def __getattr__(self, attribute):
+        """
+        Importe le module si ce n'est pas déjà fait et retourne son attribut.
+        """
+
+        # Attributs propres, absents si l'objet n'est pas initialisé.
+        if attribute.startswith('_Module__'):
+            raise AttributeError(attribute)
+
+        if self.__module is None:
+            try:
+                self.__module = importlib.import_module(self.__name)
+            except ImportError, e:
+                raise ImportError(str(e) +
+"""
+    A critical module could not be imported.
+""")
+
+        return getattr(self.__module, attribute)
+
+    def __repr__(self):
+        return '<lazy module %(name)r>' % {'name': self.__name}
@@ -4,7 +4,6 @@
 #
 try:
     import difflib
-    import math
     import re
 except ImportError, e:
     raise ImportError(str(e) +
@@ -13,14 +12,21 @@ except ImportError, e:
 """)
 
 
-__all__ = ['compare']
+__all__ = ['compare', 'iter_delta', 'get_opcodes', 'clear_comments',
+           'iter_clear_comments']
 
 
 
-def compare(old, new):
+def compare(old, new, hints =False):
     """
     Cette fonction compare les chaînes de caractères contenues dans deux
     listes.
+
+    Les lignes supprimées et ajoutées sont précédées de leur numéro de ligne.
+
+    @param hints:
+        Si vrai, les lignes modifiées sont suivies des indications de
+        caractères de difflib.ndiff ('?'). Ce calcul est coûteux.
     """
 
     # Le résultat est placé dans une liste.
@@ -31,49 +37,28 @@ def compare(old, new):
     separator = ': '
 
     # On stock le résultat obtenu dans une liste.
-    delta  = list(difflib.ndiff(old, new))
+    delta = list(iter_delta(old, new, hints))
+    if not delta:
+        return out
 
     # Pour un affichage cohérent, on cacule le nombre d'espaces maximum.
     # Cela dépend du nombre total de ligne.
     #
     # On additionne donc le nombre de chiffre maximum au nombre de caractères
     # du séparateur. 
-    spaces = (int(math.log10(len(delta))) + 1) + len(separator)
-
-    # Dans un dictionnaire, on fait correspondre les lignes de chaque liste avec
-    # avec leur numéro.
-    old_lines = dict([(re.sub('\n$', '', line), old.index(line) + 1) \
-                       for line in old])
-    new_lines = dict([(re.sub('\n$', '', line), new.index(line) + 1) \
-                       for line in new])
+    spaces = len(str(len(delta))) + len(separator)
 
 
     # On parcours les lignes du résultat.
-    for line in delta:
-        match_del = re.match('^- (.*)', line)
-        match_add = re.match('^\+ (.*)', line)
-        match_hlp = re.match('^\? (.*)', line)
-
-        line_number = None
-        line = re.sub('[\b\s\n\r]*$', '', line)
-
-        # Suppression d'une ligne
-        if match_del:
-            # On récupère le numéro de la ligne supprimée au niveau des
-            # anciennes données.
-            line_number = old_lines.get(match_del.group(1))
-        # Ajout d'une ligne
-        elif match_add:
-            # On récupère le numéro de la ligne ajoutée au niveau des
-            # nouvelles données.
-            line_number = new_lines.get(match_add.group(1))
-
-        # Si on a un numéro de ligne,
+    for tag, line_number, line in delta:
+        line = line.rstrip('\b\t\n\r\f\v ')
+
+        # Ligne supprimée ou ajoutée.
         if line_number is not None:
             # on soustraits le nombre de chiffres de la ligne et le nombre
             # de caractères contenus dans le séparateur au nombre d'espaces
             # maximums.
-            line_spaces = spaces - (int(math.log10(line_number)) + 1) - len(separator)
+            line_spaces = spaces - len(str(line_number)) - len(separator)
 
             # Puis on ajoute à notre liste de sortie la ligne résultante.
             out.append(output_format % {'line_number': line_number,
@@ -81,7 +66,7 @@ def compare(old, new):
                                         'spaces': ' ' * line_spaces,
                                         'line': line})
         # Ligne d'information,
-        elif match_hlp:
+        elif tag == '?':
             # on l'ajoute avec le nombre d'espaces maximum.
             out.append((' ' * spaces) + line)
 
@@ -89,15 +74,222 @@ def compare(old, new):
     return out
 
 
+def iter_delta(old, new, hints =False):
+    """
+    Cette fonction renvoi les différences entre deux listes de lignes sous la
+    forme de tuples (type, numéro de ligne, ligne au format ndiff).
+
+    Les lignes identiques ont le type ' ' et aucun numéro, les lignes
+    supprimées le type '-' et leur numéro dans l'ancienne liste, les lignes
+    ajoutées le type '+' et leur numéro dans la nouvelle liste. Les
+    indications de caractères, si elles sont demandées, ont le type '?'.
+    """
+
+    for tag, i1, i2, j1, j2 in get_opcodes(old, new):
+        if tag == 'equal':
+            for line in old[i1:i2]:
+                yield (' ', None, '  ' + line)
+            continue
+
+        if tag == 'replace' and hints:
+            # Les indications ne sont calculées que sur les lignes
+            # modifiées.
+            i, j = i1, j1
+            for line in difflib.ndiff(old[i1:i2], new[j1:j2]):
+                if line[0] == '-':
+                    i += 1
+                    yield ('-', i, line)
+                elif line[0] == '+':
+                    j += 1
+                    yield ('+', j, line)
+                elif line[0] == '?':
+                    yield ('?', None, line)
+                else:
+                    i += 1
+                    j += 1
+                    yield (' ', None, line)
+            continue
+
+        for i in xrange(i1, i2):
+            yield ('-', i + 1, '- ' + old[i])
+        for j in xrange(j1, j2):
+            yield ('+', j + 1, '+ ' + new[j])
+
+
+def get_opcodes(old, new):
+    """
+    Cette fonction renvoi la liste des opérations transformant une liste de
+    lignes en une autre, au même format que
+    difflib.SequenceMatcher.get_opcodes().
+
+    L'algorithme utilisé est le « patience diff » : les lignes uniques dans
+    les deux listes servent de points d'ancrage et seules les zones entre
+    ces points sont comparées. Le coût est proche de linéaire pour des
+    fichiers de configuration.
+    """
+
+    blocks = list()
+    _match_blocks(old, 0, len(old), new, 0, len(new), blocks)
+
+    opcodes = list()
+    i = j = 0
+    for a, b, size in blocks + [(len(old), len(new), 0)]:
+        tag = ''
+        if i < a and j < b:
+            tag = 'replace'
+        elif i < a:
+            tag = 'delete'
+        elif j < b:
+            tag = 'insert'
+        if tag:
+            opcodes.append((tag, i, a, j, b))
+
+        if size:
+            opcodes.append(('equal', a, a + size, b, b + size))
+
+        i, j = a + size, b + size
+
+    return opcodes
+
+
+# Au-delà de ce nombre de lignes, une zone sans ligne unique n'est pas
+# comparée avec difflib et est considérée comme remplacée.
+_difflib_limit = 1000
+
+def _match_blocks(old, alo, ahi, new, blo, bhi, blocks):
+    """
+    Ajoute à la liste les blocs de lignes identiques (i, j, taille) entre
+    old[alo:ahi] et new[blo:bhi].
+    """
+
+    # Les lignes identiques au début et à la fin sont mises de côté.
+    start = 0
+    while alo + start < ahi and blo + start < bhi and \
+          old[alo + start] == new[blo + start]:
+        start += 1
+
+    end = 0
+    while alo + start < ahi - end and blo + start < bhi - end and \
+          old[ahi - end - 1] == new[bhi - end - 1]:
+        end += 1
+
+    if start:
+        blocks.append((alo, blo, start))
+
+    alo, blo = alo + start, blo + start
+    ahi, bhi = ahi - end, bhi - end
+
+    if alo < ahi and blo < bhi:
+        anchors = _unique_anchors(old, alo, ahi, new, blo, bhi)
+
+        if anchors:
+            # On compare récursivement les zones entre les ancres.
+            i, j = alo, blo
+            for a, b in anchors:
+                _match_blocks(old, i, a, new, j, b, blocks)
+                i, j = a, b
+            _match_blocks(old, i, ahi, new, j, bhi, blocks)
+        elif (ahi - alo) * (bhi - blo) <= _difflib_limit ** 2:
+            # Zone sans ligne unique, par exemple des lignes répétées.
+            matcher = difflib.SequenceMatcher(None, old[alo:ahi],
+                                              new[blo:bhi], False)
+            for a, b, size in matcher.get_matching_blocks():
+                if size:
+                    blocks.append((alo + a, blo + b, size))
+
+    if end:
+        blocks.append((ahi, bhi, end))
+
+def _unique_anchors(old, alo, ahi, new, blo, bhi):
+    """
+    Retourne les couples (i, j) de lignes présentes une seule fois dans
+    chaque zone, dans le plus long ordre commun.
+    """
+
+    # Ligne -> [nombre dans old, position dans old, nombre dans new,
+    #           position dans new]
+    lines = dict()
+    for i in xrange(alo, ahi):
+        entry = lines.setdefault(old[i], [0, 0, 0, 0])
+        entry[0] += 1
+        entry[1] = i
+    for j in xrange(blo, bhi):
+        entry = lines.get(new[j])
+        if entry is not None:
+            entry[2] += 1
+            entry[3] = j
+
+    pairs = [(entry[1], entry[3]) for entry in lines.itervalues() \
+             if entry[0] == 1 and entry[2] == 1]
+    pairs.sort()
+
+    # Plus longue sous-suite croissante des positions dans new, par la
+    # méthode du patience sorting.
+    tails = list()
+    previous = [None] * len(pairs)
+    for n, (i, j) in enumerate(pairs):
+        k = _bisect(pairs, tails, j)
+        if k > 0:
+            previous[n] = tails[k - 1]
+        if k == len(tails):
+            tails.append(n)
+        else:
+            tails[k] = n
+
+    anchors = list()
+    n = tails[-1] if tails else None
+    while n is not None:
+        anchors.append(pairs[n])
+        n = previous[n]
+    anchors.reverse()
+
+    return anchors
+
+def _bisect(pairs, tails, j):
+    """
+    Retourne la position de la première pile dont le sommet est supérieur ou
+    égal à j.
+    """
+
+    lo, hi = 0, len(tails)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if pairs[tails[mid]][1] < j:
+            lo = mid + 1
+        else:
+            hi = mid
+
+    return lo
+
+
 def clear_comments(content, marker):
-    out = list()
+    """
+    Cette fonction retourne la liste des lignes sans les commentaires.
+
+    Voir iter_clear_comments.
+    """
+
+    return list(iter_clear_comments(content, marker))
+
+
+def iter_clear_comments(content, marker):
+    """
+    Cette fonction enlève les commentaires des lignes au fur et à mesure de
+    leur lecture. Les lignes ne contenant qu'un commentaire sont ignorées.
+
+    Le contenu peut être n'importe quel itérable de lignes.
+    """
+
+    # Les expressions ne sont compilées qu'une fois.
+    comment_line = re.compile('^\s*' + marker + '+.*$')
+    comment      = re.compile('^.*(\s*' + marker + '+.*)$')
+
     for line in content:
-        if re.match('^\s*' + marker + '+.*$', line):
+        if comment_line.match(line):
             continue
 
-        comment = re.match('^.*(\s*' + marker + '+.*)$', line)
-        if comment:
-            line = re.sub(comment.group(1), '', line)
-        out.append(line)
+        match = comment.match(line)
+        if match:
+            line = line[:match.start(1)]
 
-    return out
+        yield line
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+#
+# tests/test_delta.py
+#
+try:
+    import os
+    import sys
+    import random
+    import shutil
+    import tempfile
+    import unittest
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    os.pardir, 'src', 'lib'))
+
+    from fs import backup, delta
+
+    from test_text import make_config, edit
+except ImportError, e:
+    raise ImportError(str(e) +
+"""
+    A critical module could not be imported.
+""")
+
+
+
+
+class DeltaTest(unittest.TestCase):
+    """
+    A delta made from two lists of lines must rebuild the target from the
+    base.
+    """
+
+    def check(self, base, target):
+        self.assertEqual(delta.apply(base, delta.make(base, target)), target)
+
+    def test_empty(self):
+        self.check([], [])
+        self.check([], ['a'])
+        self.check(['a'], [])
+
+    def test_random_edits(self):
+        # Older files are stored as deltas from the newer ones.
+        rng = random.Random(5)
+        for n in xrange(200):
+            old = make_config(rng, rng.randint(0, 300))
+            new = edit(rng, old, rng.randint(1, 20))
+            self.check(new, old)
+            self.check(old, new)
+
+    def test_operation_like_lines(self):
+        # Inserted lines looking like delta operations are kept as is.
+        self.check(['a', 'b'], ['+ 1', 'a', '= 0 1', 'b', '+ 2'])
+
+    def test_malformed(self):
+        self.assertRaises(ValueError, delta.apply, ['a'], ['? 1'])
+        self.assertRaises(ValueError, delta.apply, ['a'], ['= 0'])
+
+
+
+
+class ReverseDeltaTest(unittest.TestCase):
+    """
+    Every version written in a backup directory with checkpoints must be read
+    back as it was written.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix ='nodesnap-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def check(self, compression):
+        rng = random.Random(6)
+        storage = backup.Backup(self.directory, compression =compression,
+                                checkpoint =4)
+
+        versions = list()
+        content = make_config(rng, 200)
+        for n in xrange(15):
+            content = edit(rng, content, rng.randint(1, 10))
+            name = 'node-%(n)05i' % {'n': n}
+            storage.write(name, content)
+            versions.append((name, backup.normalize(content)))
+
+        # Older files are stored as deltas, only the checkpoints are full
+        # copies.
+        files = dict([(backup.strip_suffix(f).split('.')[0], f) \
+                      for f in storage.get_filenames_list()])
+        self.assertEqual(len(files), len(versions))
+        self.assertTrue(len([f for f in files.values() \
+                             if '.rdelta' in f]) > len(versions) / 2)
+
+        for name, lines in versions:
+            self.assertEqual(storage.read(files[name]), lines)
+
+        self.assertEqual(storage.get_most_recent_file_content(),
+                         versions[-1][1])
+
+    def test_plain(self):
+        self.check(None)
+
+    def test_gzip(self):
+        self.check('gzip')
+
+    def test_bz2(self):
+        self.check('bz2')
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+#
+# tests/test_storage.py
+#
+try:
+    import os
+    import sys
+    import shutil
+    import tempfile
+    import unittest
+    import subprocess
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    os.pardir, 'src', 'lib'))
+
+    from fs import backup, gitstore, objects, retention, sqlstore
+except ImportError, e:
+    raise ImportError(str(e) +
+"""
+    A critical module could not be imported.
+""")
+
+
+
+def has_git():
+    """
+    Returns True if the git command is available.
+    """
+
+    try:
+        return subprocess.call(['git', '--version'],
+                               stdout =open(os.devnull, 'w')) == 0
+    except OSError:
+        return False
+
+def make_config(node, run):
+    """
+    Returns the configuration of a node for a run. A node changes every
+    other run.
+    """
+
+    return ['hostname node%(n)i' % {'n': node}] + \
+           ['interface %(i)i' % {'i': i} for i in xrange(50)] + \
+           ['! version %(v)i' % {'v': (run + node) // 2}]
+
+
+
+
+class StorageTest(unittest.TestCase):
+    """
+    Every backend and storage must give back the written files, whatever the
+    files removed by retention between two commits.
+    """
+
+    nodes = 4
+    runs = 6
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix ='nodesnap-test-')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_scenario(self, factory, commit, keep):
+        """
+        Writes the configuration of every node at each run, applies the
+        retention policy and commits, checking the stored files.
+        """
+
+        policy = retention.Policy(last =keep)
+
+        for run in xrange(self.runs):
+            for node in xrange(self.nodes):
+                storage = factory('backup/node%(n)i' % {'n': node})
+                config = make_config(node, run)
+
+                if storage.get_last_digest()[0] != backup.digest(config):
+                    storage.write('node%(n)i-%(r)05i' % {'n': node, 'r': run},
+                                  config)
+                storage.apply_retention(policy)
+
+                self.assertEqual(storage.get_most_recent_file_content(),
+                                 config)
+                self.assertEqual(storage.get_last_digest()[0],
+                                 backup.digest(config))
+
+            commit()
+
+    def get_backup(self, store, compression, checkpoint):
+        """
+        Returns the storage factory and the commit function of the 'files'
+        backend.
+        """
+
+        store = store and objects.ObjectStore(self.directory + os.sep \
+                                              + 'objects') or None
+
+        return (lambda directory: backup.Backup(self.directory + os.sep \
+                                                + directory,
+                                                store, compression,
+                                                checkpoint),
+                lambda: None)
+
+    def get_git(self, store, compression, checkpoint):
+        """
+        Returns the storage factory and the commit function of the 'git'
+        backend. Once committed, the repository must match the directories.
+        """
+
+        repository = gitstore.Repository(self.directory)
+        store = store and objects.ObjectStore(self.directory + os.sep \
+                                              + 'objects') or None
+
+        def commit():
+            repository.commit('test')
+
+            status = subprocess.Popen(['git', 'status', '--porcelain'],
+                                      cwd =self.directory,
+                                      stdout =subprocess.PIPE).communicate()[0]
+            self.assertEqual(status, '')
+
+        return (lambda directory: gitstore.GitBackup(repository,
+                                                     self.directory + os.sep \
+                                                     + directory,
+                                                     store, compression,
+                                                     checkpoint),
+                commit)
+
+    def check(self, backend, store =False, compression =None,
+              checkpoint =None):
+        for keep in (1, 3):
+            self.run_scenario(*backend(store, compression, checkpoint),
+                              keep =keep)
+            self.tearDown()
+            self.setUp()
+
+    def test_files(self):
+        self.check(self.get_backup)
+        self.check(self.get_backup, compression ='gzip')
+        self.check(self.get_backup, checkpoint =3)
+        self.check(self.get_backup, store =True)
+
+    @unittest.skipUnless(has_git(), 'git is not available')
+    def test_git(self):
+        self.check(self.get_git)
+
+    @unittest.skipUnless(has_git(), 'git is not available')
+    def test_git_delta(self):
+        self.check(self.get_git, checkpoint =3)
+        self.check(self.get_git, compression ='bz2', checkpoint =3)
+
+    @unittest.skipUnless(has_git(), 'git is not available')
+    def test_git_dedup(self):
+        self.check(self.get_git, store =True)
+
+    @unittest.skipUnless(has_git(), 'git is not available')
+    def test_git_compression(self):
+        self.check(self.get_git, compression ='gzip')
+        self.check(self.get_git, compression ='bz2')
+
+    def test_sqlite(self):
+        for compression in (None, 'gzip', 'bz2'):
+            database = sqlstore.Database(self.directory + os.sep + 'test.db',
+                                         False)
+            try:
+                for keep in (1, 3):
+                    self.run_scenario(
+                        lambda directory: sqlstore.SQLiteBackup(database,
+                                                                directory,
+                                                                compression),
+                        database.commit, keep)
+            finally:
+                database.close()
+
+            os.unlink(self.directory + os.sep + 'test.db')
+
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+#
+# tests/test_text.py
+#
+try:
+    import os
+    import sys
+    import random
+    import difflib
+    import unittest
+
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                    os.pardir, 'src', 'lib'))
+
+    from util import text
+except ImportError, e:
+    raise ImportError(str(e) +
+"""
+    A critical module could not be imported.
+""")
+
+
+
+def make_config(rng, size):
+    """
+    Returns a random configuration: unique lines mixed with lines repeated
+    in every block, as in a real node configuration.
+    """
+
+    lines = list()
+    for n in xrange(size):
+        choice = rng.random()
+        if choice < 0.2:
+            lines.append('!')
+        elif choice < 0.4:
+            lines.append(' shutdown')
+        elif choice < 0.5:
+            lines.append(' switchport mode access')
+        else:
+            lines.append('interface %(n)i %(r)i' % {'n': n,
+                                                    'r': rng.randint(0, 9)})
+
+    return lines
+
+def edit(rng, lines, count):
+    """
+    Returns a copy of the given lines with random insertions, deletions,
+    replacements and moves of blocks of lines.
+    """
+
+    lines = list(lines)
+    for n in xrange(count):
+        i = rng.randint(0, len(lines))
+        size = rng.randint(1, 5)
+        action = rng.choice(['insert', 'delete', 'replace', 'move'])
+
+        if action == 'insert':
+            lines[i:i] = ['new %(n)i %(k)i' % {'n': n, 'k': k} \
+                          for k in xrange(size)]
+        elif action == 'delete':
+            del lines[i:i + size]
+        elif action == 'replace':
+            lines[i:i + size] = [rng.choice(['!', ' shutdown', 'changed'])
+                                 for k in xrange(size)]
+        else:
+            block = lines[i:i + size]
+            del lines[i:i + size]
+            j = rng.randint(0, len(lines))
+            lines[j:j] = block
+
+    return lines
+
+def rebuild(old, new, opcodes):
+    """
+    Returns the list of lines rebuilt from old by the given opcodes, checking
+    that they cover both lists without gaps.
+    """
+
+    out = list()
+    i = j = 0
+    for tag, i1, i2, j1, j2 in opcodes:
+        assert (i1, j1) == (i, j), 'gap before %r' % ((tag, i1, i2, j1, j2),)
+
+        if tag == 'equal':
+            assert old[i1:i2] == new[j1:j2], 'unequal %r' % ((i1, i2, j1, j2),)
+            out.extend(old[i1:i2])
+        else:
+            out.extend(new[j1:j2])
+
+        i, j = i2, j2
+
+    assert (i, j) == (len(old), len(new)), 'opcodes end early'
+
+    return out
+
+
+
+
+class GetOpcodesTest(unittest.TestCase):
+    """
+    The opcodes of get_opcodes() must rebuild the new list from the old one.
+    """
+
+    def check(self, old, new):
+        opcodes = text.get_opcodes(old, new)
+        self.assertEqual(rebuild(old, new, opcodes), new)
+
+        return opcodes
+
+    def test_empty(self):
+        self.assertEqual(self.check([], []), [])
+        self.check([], ['a', 'b'])
+        self.check(['a', 'b'], [])
+
+    def test_identical(self):
+        lines = make_config(random.Random(1), 200)
+        self.assertEqual(self.check(lines, lines),
+                         [('equal', 0, len(lines), 0, len(lines))])
+
+    def test_random_edits(self):
+        rng = random.Random(2)
+        for n in xrange(200):
+            old = make_config(rng, rng.randint(0, 300))
+            self.check(old, edit(rng, old, rng.randint(1, 20)))
+
+    def test_no_unique_lines(self):
+        # Zones without unique lines, under and over the difflib limit.
+        rng = random.Random(3)
+        for size in (10, 500, 3000):
+            old = [rng.choice(['!', ' shutdown']) for n in xrange(size)]
+            new = [rng.choice(['!', ' shutdown']) for n in xrange(size)]
+            self.check(old, new)
+
+    def test_iter_delta(self):
+        # The lines of iter_delta() are those of difflib.ndiff() for the
+        # same changes.
+        rng = random.Random(4)
+        for n in xrange(50):
+            old = make_config(rng, rng.randint(0, 100))
+            new = edit(rng, old, rng.randint(1, 10))
+
+            delta = list(text.iter_delta(old, new))
+            self.assertEqual([line[2:] for tag, number, line in delta \
+                              if tag in ' -'], old)
+            self.assertEqual([line[2:] for tag, number, line in delta \
+                              if tag in ' +'], new)
+
+            for tag, number, line in delta:
+                if tag == '-':
+                    self.assertEqual(old[number - 1], line[2:])
+                elif tag == '+':
+                    self.assertEqual(new[number - 1], line[2:])
+
+    def test_hints(self):
+        old = ['interface 1', ' description uplink', '!']
+        new = ['interface 1', ' description upl1nk', '!']
+
+        delta = list(text.iter_delta(old, new, True))
+        self.assertEqual([line for tag, number, line in delta if tag != ' '],
+                         [line for line in difflib.ndiff(old, new) \
+                          if line[0] in '-+?'])
+
+
+
+if __name__ == '__main__':
+    unittest.main()